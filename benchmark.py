@@ -0,0 +1,448 @@
+# Бенчмарки folderMonitor.
+#
+#     python benchmark.py frequency [--names 1000000] [--cache-size 4096]
+#     python benchmark.py sync [--files 10000|100000|1000000] [--depth 3] [--cycles 20]
+#     python benchmark.py walk [--files 10000] [--latency-ms 5] [--workers 1,4,16]
+#     python benchmark.py startup [--runs 5] [--max-ms 250]
+#     python benchmark.py memory [--files 100000]
+#
+# walk вимірює повний прохід сканера з різною кількістю потоків обходу; --latency-ms імітує
+# мережеву папку (SMB/NFS), де кожне читання каталогу коштує запиту до сервера.
+# startup показує вартість імпорту startMonitor по модулях (python -X importtime) і перевіряє,
+# що Firebase SDK не імпортується під час запуску; з --max-ms повертає код 1 при перевищенні бюджету.
+# memory вимірює пам'ять на файл для початкового списку і відстежуваних файлів, відновлених з індексу.
+# sync генерує синтетичне дерево, на кожному циклі додає, змінює і видаляє частину файлів
+# і проганяє цикл синхронізації (сканер, різниця, пакет Firebase, локальний індекс)
+# проти fake_firebase - локальної заміни Realtime Database
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import fake_firebase
+import startMonitor
+
+def legacy_extract_frequency(file_path):
+    # Попередня реалізація extract_frequency_from_file - для порівняння
+    filename = os.path.splitext(os.path.basename(file_path))[0]
+    match = re.search(r'(\d{3})[.,](\d{3})', filename)
+    if match:
+        return f"{match.group(1)}.{match.group(2)}"
+    match = re.search(r'\d{3,6}', filename)
+    if match:
+        number = match.group(0)
+        if len(number) == 3:
+            return f"{number}.000"
+        return f"{number[:3]}.{number[3:]}"
+    return None
+
+def letters(number):
+    result = []
+    while True:
+        number, rest = divmod(number, 26)
+        result.append(string.ascii_lowercase[rest])
+        if not number:
+            return "".join(result)
+
+def synthetic_names(count, seed=1):
+    # Чверть імен без частоти, щоб було видно роботу негативного кешу
+    rng = random.Random(seed)
+    names = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            names.append(f"D:/monitoring/monitor/rec_{rng.randint(100, 999)}.{rng.randint(0, 999):03d}_{letters(i)}.wav")
+        elif kind == 1:
+            names.append(f"D:/monitoring/monitor/{rng.randint(100000, 999999)}_{letters(i)}.wav")
+        elif kind == 2:
+            names.append(f"D:/monitoring/monitor/sub/{rng.randint(100, 999)}_{letters(i)}.raw")
+        else:
+            names.append(f"D:/monitoring/monitor/notes_{letters(i)}.txt")
+    return names
+
+def timed(label, func, names):
+    started = time.perf_counter()
+    found = 0
+    for name in names:
+        if func(name):
+            found += 1
+    elapsed = time.perf_counter() - started
+    print(f"{label:<32} {elapsed:8.3f} с  {elapsed / len(names) * 1e6:7.3f} мкс/ім'я  (з частотою: {found})")
+    return elapsed
+
+def bench_frequency(args):
+    names = synthetic_names(args.names)
+    print(f"Імен: {len(names)}")
+    legacy = timed("попередня реалізація", legacy_extract_frequency, names)
+    # Усі імена унікальні: кеш імен без частоти не влучає, це вартість розбору нового файлу
+    parser = startMonitor.FrequencyParser(cache_size=args.cache_size)
+    cold = timed("FrequencyParser, нові імена", parser.parse, names)
+    print(f"Новий файл: {cold / legacy:.2f} від часу попередньої реалізації, "
+          f"{(cold - legacy) / len(names) * 1e6:+.3f} мкс/ім'я")
+    # Службові файли без частоти, що з'являються знову й знову (Thumbs.db, тимчасові файли запису)
+    repeated = [f"D:/monitoring/monitor/sub{i % 1000}/notes_{letters(i % 100)}.tmp" for i in range(len(names))]
+    legacy_repeated = timed("попередня реалізація, без частоти", legacy_extract_frequency, repeated)
+    cached = timed("FrequencyParser, без частоти", parser.parse, repeated)
+    print(f"Імена без частоти з кешу ({len(parser.unmatched)} з {args.cache_size}): "
+          f"{legacy_repeated / cached:.1f} раз(ів) швидше за попередню реалізацію")
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux повертає кілобайти, macOS - байти
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+def build_tree(root, files, depth, files_per_dir, seed=1):
+    # Файли розкладаються по листових каталогам дерева заданої глибини
+    marker = root + ".spec"
+    spec = f"{files} {depth} {files_per_dir}"
+    if os.path.exists(marker) and open(marker).read() == spec:
+        return
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.makedirs(root)
+
+    rng = random.Random(seed)
+    directories = max(1, math.ceil(files / files_per_dir))
+    fanout = max(2, math.ceil(directories ** (1 / max(depth, 1))))
+    created = 0
+    for index in range(directories):
+        parts = []
+        number = index
+        for _ in range(depth):
+            number, rest = divmod(number, fanout)
+            parts.append(f"d{rest}")
+        directory = os.path.join(root, *parts)
+        os.makedirs(directory, exist_ok=True)
+        for _ in range(min(files_per_dir, files - created)):
+            open(os.path.join(directory, churn_name(rng, created)), "w").close()
+            created += 1
+    with open(marker, "w") as file:
+        file.write(spec)
+
+def churn_name(rng, number):
+    if number % 4 == 3:
+        return f"notes_{letters(number)}.txt"
+    return f"rec_{rng.randint(100, 999)}.{rng.randint(0, 999):03d}_{letters(number)}.wav"
+
+class ChurnProfile:
+    def __init__(self, root, adds, modifies, deletes, seed=2):
+        self.rng = random.Random(seed)
+        self.directories = [path for path, _, _ in os.walk(root)]
+        self.baseline = [os.path.join(path, name) for path, _, names in os.walk(root) for name in names]
+        self.added = []
+        self.adds = adds
+        self.modifies = modifies
+        self.deletes = deletes
+        self.counter = 10 ** 7
+
+    def apply(self):
+        for _ in range(self.adds):
+            self.counter += 1
+            path = os.path.join(self.rng.choice(self.directories), churn_name(self.rng, self.counter))
+            open(path, "w").close()
+            self.added.append(path)
+
+        # Зміни й видалення переважно серед нових файлів - саме вони відстежуються у Firebase
+        candidates = self.added or self.baseline
+        for path in self.rng.sample(candidates, min(self.modifies, len(candidates))):
+            with open(path, "a") as file:
+                file.write("x")
+            mtime = time.time() + 1
+            os.utime(path, (mtime, mtime))
+        for _ in range(min(self.deletes, len(self.added))):
+            os.remove(self.added.pop(self.rng.randrange(len(self.added))))
+
+async def run_sync_cycles(args, root, database):
+    engine = startMonitor.MonitorEngine(args.scan_workers, args.firebase_workers)
+    engine.bind_loop()
+    window_name = "benchmark"
+    startMonitor.tracked_files[window_name] = {}
+    startMonitor.window_schemas[window_name] = startMonitor.RecordSchema(args.schema, window_name, root)
+
+    subscription = startMonitor.ScanSubscription(window_name, root)
+    shared = startMonitor.SharedScanner(subscription.root)
+    shared.scanner.workers = args.walk_workers
+    subscription.shared = shared
+    started = time.perf_counter()
+    await engine.run_in_scan(shared.scanner.scan)
+    subscription.initial_files = await engine.run_in_scan(subscription.baseline)
+    await startMonitor.restore_window_state(engine, window_name, root, subscription)
+    print(f"Початковий прохід: {time.perf_counter() - started:.3f} с, "
+          f"{shared.scanner.files_stated} stat файлів, {shared.scanner.dirs_listed} каталогів")
+
+    churn = ChurnProfile(root, args.adds, args.modifies, args.deletes)
+    results = []
+    for cycle in range(1, args.cycles + 1):
+        churn.apply()
+        database.reset_counters()
+        full = args.full_every > 0 and cycle % args.full_every == 0
+
+        started = time.perf_counter()
+        diff = await engine.run_in_scan(shared.scanner.scan, full)
+        events = subscription.translate(startMonitor.scan_diff_events(diff))
+        batch = startMonitor.FirebaseBatch()
+        await engine.run_in_scan(startMonitor.apply_file_events, window_name, batch, subscription, events,
+                                 subscription.initial_files)
+        changes = len(batch)
+        await startMonitor.commit_batch(engine, window_name, batch)
+        elapsed = time.perf_counter() - started
+
+        results.append({
+            "cycle": cycle,
+            "full": full,
+            "seconds": elapsed,
+            "dirs_visited": shared.scanner.dirs_visited,
+            "dirs_listed": shared.scanner.dirs_listed,
+            "files_stated": shared.scanner.files_stated,
+            "changes": changes,
+            "round_trips": database.round_trips,
+            "bytes_sent": database.bytes_sent,
+        })
+
+    engine.scan_executor.shutdown()
+    engine.io_executor.shutdown()
+    return results
+
+class HighLatencyScanner(startMonitor.IncrementalScanner):
+    def __init__(self, directory_path, workers, latency):
+        super().__init__(directory_path, workers)
+        self.latency = latency
+
+    def _read_directory(self, *args):
+        time.sleep(self.latency)
+        return super()._read_directory(*args)
+
+def bench_walk(args):
+    workdir = args.dir or tempfile.mkdtemp(prefix="folderMonitor-bench-")
+    root = os.path.join(workdir, "tree")
+    build_tree(root, args.files, args.depth, args.files_per_dir)
+    print(f"Дерево {root}: {args.files} файлів, глибина {args.depth}, затримка {args.latency_ms} мс на каталог")
+
+    baseline = None
+    for workers in [int(value) for value in args.workers.split(",")]:
+        scanner = HighLatencyScanner(root, workers, args.latency_ms / 1000)
+        started = time.perf_counter()
+        diff = scanner.scan(full=True)
+        elapsed = time.perf_counter() - started
+        scanner.close()
+        baseline = baseline or elapsed
+        print(f"потоків: {workers:>3}  {elapsed:8.3f} с  каталогів: {scanner.dirs_listed}  файлів: {len(diff.added)}  "
+              f"прискорення: {baseline / elapsed:.1f}x")
+    if not args.dir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def bench_memory(args):
+    workdir = args.dir or tempfile.mkdtemp(prefix="folderMonitor-bench-")
+    root = os.path.join(workdir, "tree")
+    build_tree(root, args.files, args.depth, args.files_per_dir)
+    startMonitor.log_console = False
+    startMonitor.log_buffer_lines = 0
+    scanner = startMonitor.IncrementalScanner(root)
+    scanner.scan(full=True)
+    files = dict(scanner.iter_files(root))
+    parser = startMonitor.get_frequency_parser("Global")
+
+    # Два вікна на одному дереві: в одному всі файли в початковому списку, в іншому всі файли з частотою відстежуються
+    startMonitor.tracked_files["tracked"] = {}
+    for file_path, last_modified in files.items():
+        frequency = parser.parse(file_path)
+        if frequency:
+            startMonitor.track_file("tracked", startMonitor.FirebaseBatch(), file_path, frequency, last_modified)
+    state_file = os.path.join(workdir, "benchmark_state.db")
+    if os.path.exists(state_file):
+        os.remove(state_file)
+    store = startMonitor.StateStore(state_file)
+    store.save_window("baseline", root, {}, startMonitor.PathDigestSet(files))
+    store.save_window("tracked", root, startMonitor.tracked_files.pop("tracked"), startMonitor.PathDigestSet())
+
+    # Пам'ять рахується для структур у тому вигляді, в якому їх відновлює теплий перезапуск
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    _, initial_files = store.load_window("baseline", root)
+    baseline_size = tracemalloc.get_traced_memory()[0] - before
+    before = tracemalloc.get_traced_memory()[0]
+    tracked, _ = store.load_window("tracked", root)
+    tracked_size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    found = sum(1 for file_path in files if file_path in initial_files)
+    lookup = (time.perf_counter() - started) / max(len(files), 1)
+    print(f"Дерево {root}: {len(files)} файлів, з частотою {len(tracked)}")
+    print(f"Початковий список: {baseline_size / 2**20:.1f} МБ, {baseline_size / max(len(initial_files), 1):.0f} байт на файл, "
+          f"перевірка шляху {lookup * 10**6:.2f} мкс ({found} збігів)")
+    print(f"Відстежувані файли: {tracked_size / 2**20:.1f} МБ, {tracked_size / max(len(tracked), 1):.0f} байт на файл")
+    rss = peak_rss_mb()
+    print(f"Пікова пам'ять (RSS): {rss:.1f} МБ" if rss is not None else "Пікова пам'ять (RSS): н/д")
+    if not args.dir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+LAZY_MODULES = ("firebase_admin", "google", "requests", "http.server")
+
+def import_times(statement):
+    # [(модуль, власний час, сумарний час, глибина вкладеності)] у порядку виводу -X importtime, в мікросекундах
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, total, name = line[len("import time:"):].split("|")
+        times.append((name.strip(), int(own), int(total), (len(name) - len(name.lstrip()) - 1) // 2))
+    return times
+
+def module_imports(times, module):
+    # Вкладені імпорти модуля йдуть у виводі перед ним самим, до попереднього модуля верхнього рівня
+    index = next(i for i, item in enumerate(times) if item[0] == module and item[3] == 0)
+    start = index
+    while start > 0 and times[start - 1][3] > 0:
+        start -= 1
+    return times[index], times[start:index]
+
+def bench_startup(args):
+    # Найкращий з кількох запусків, щоб не міряти холодний кеш диска
+    runs = [module_imports(import_times("import startMonitor"), "startMonitor") for _ in range(args.runs)]
+    (_, own, total, _), nested = min(runs, key=lambda run: run[0][2])
+    total /= 1000
+    print(f"Імпорт startMonitor: {total:.1f} мс (найкращий з {args.runs}), з них код модуля {own / 1000:.1f} мс")
+    print("Найдорожчі прямі імпорти:")
+    direct = [item for item in nested if item[3] == 1]
+    for name, _, cumulative, _ in sorted(direct, key=lambda item: -item[2])[:args.top]:
+        print(f"  {name:<28} {cumulative / 1000:7.1f} мс")
+
+    eager = sorted({lazy for item in nested for lazy in LAZY_MODULES
+                    if item[0] == lazy or item[0].startswith(lazy + ".")})
+    if eager:
+        print(f"ПОМИЛКА: під час запуску імпортуються модулі, які мають вантажитися відкладено: {', '.join(eager)}")
+    try:
+        firebase = import_times("import firebase_admin; from firebase_admin import credentials, db")
+        print(f"Firebase SDK (відкладено до першого підключення): "
+              f"{sum(item[2] for item in firebase if item[3] == 0 and item[0] != 'encodings') / 1000:.1f} мс")
+    except RuntimeError as e:
+        print(f"Firebase SDK не встановлено: {e}")
+
+    if args.max_ms and total > args.max_ms:
+        print(f"ПОМИЛКА: імпорт довший за бюджет {args.max_ms:.0f} мс")
+    if eager or (args.max_ms and total > args.max_ms):
+        sys.exit(1)
+
+def bench_sync(args):
+    workdir = args.dir or tempfile.mkdtemp(prefix="folderMonitor-bench-")
+    root = os.path.join(workdir, "tree")
+    started = time.perf_counter()
+    build_tree(root, args.files, args.depth, args.files_per_dir)
+    print(f"Дерево {root}: {args.files} файлів, глибина {args.depth} ({time.perf_counter() - started:.1f} с)")
+
+    # Без виводу кожного файлу в консоль і з окремим індексом для бенчмарку
+    startMonitor.log_console = False
+    startMonitor.STATE_FILE = os.path.join(workdir, "benchmark_state.db")
+    if os.path.exists(startMonitor.STATE_FILE):
+        os.remove(startMonitor.STATE_FILE)
+    database = fake_firebase.FakeDatabase(latency=args.latency_ms / 1000)
+    startMonitor.db = database
+    # Цикли тут ідуть без пауз, тож захисне вікно для грубих міток часу за замовчуванням вимкнене,
+    # інакше щойно згенероване дерево перечитувалося б повністю на кожному циклі
+    startMonitor.RACY_MTIME_NS = int(args.racy_window_ms * 10**6)
+    # Файли бенчмарку щойно створені, тож з періодом тиші вони чекали б дописування між циклами
+    startMonitor.settle_seconds = args.settle_ms / 1000
+
+    results = asyncio.run(run_sync_cycles(args, root, database))
+    seconds = [result["seconds"] * 1000 for result in results]
+    print(f"Циклів: {len(results)} (зміни на цикл: +{args.adds} ~{args.modifies} -{args.deletes})")
+    print(f"Тривалість циклу, мс: p50 {percentile(seconds, 0.5):.1f}  p90 {percentile(seconds, 0.9):.1f}  "
+          f"p99 {percentile(seconds, 0.99):.1f}  max {max(seconds):.1f}")
+    print(f"stat файлів за цикл: {sum(r['files_stated'] for r in results) / len(results):.0f} в середньому, "
+          f"каталогів: {sum(r['dirs_visited'] for r in results) / len(results):.0f} перевірено, "
+          f"{sum(r['dirs_listed'] for r in results) / len(results):.0f} перечитано")
+    print(f"Запитів до Firebase: {sum(r['round_trips'] for r in results)} "
+          f"на {sum(r['changes'] for r in results)} змін, {sum(r['bytes_sent'] for r in results) / 1024:.1f} КБ "
+          f"(схема записів {args.schema})")
+    rss = peak_rss_mb()
+    print(f"Пікова пам'ять (RSS): {rss:.1f} МБ" if rss is not None else "Пікова пам'ять (RSS): н/д")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"files": args.files, "depth": args.depth, "peak_rss_mb": rss, "cycles": results}, file, indent=4)
+    if not args.dir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки folderMonitor")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    frequency = commands.add_parser("frequency", help="розбір частот з імен файлів")
+    frequency.add_argument("--names", type=int, default=1000000, help="кількість синтетичних імен")
+    frequency.add_argument("--cache-size", type=int, default=startMonitor.frequency_cache_size,
+                           help="розмір кешу імен без частоти (frequency_cache_size у config.json)")
+    frequency.set_defaults(func=bench_frequency)
+
+    startup = commands.add_parser("startup", help="вартість імпорту startMonitor по модулях")
+    startup.add_argument("--runs", type=int, default=5, help="кількість запусків")
+    startup.add_argument("--top", type=int, default=15, help="скільки модулів показати")
+    startup.add_argument("--max-ms", type=float, default=0, help="бюджет на імпорт, мс (0 - без перевірки)")
+    startup.set_defaults(func=bench_startup)
+
+    walk = commands.add_parser("walk", help="повний прохід сканера з паралельним обходом каталогів")
+    walk.add_argument("--files", type=int, default=10000, help="кількість файлів у дереві")
+    walk.add_argument("--depth", type=int, default=3, help="глибина вкладеності каталогів")
+    walk.add_argument("--files-per-dir", type=int, default=100, help="файлів в одному каталозі")
+    walk.add_argument("--latency-ms", type=float, default=5.0, help="затримка читання одного каталогу")
+    walk.add_argument("--workers", default="1,4,16", help="кількість потоків обходу через кому")
+    walk.add_argument("--dir", help="робочий каталог (дерево зберігається між запусками)")
+    walk.set_defaults(func=bench_walk)
+
+    memory = commands.add_parser("memory", help="пам'ять на файл для початкового списку і відстежуваних файлів")
+    memory.add_argument("--files", type=int, default=100000, help="кількість файлів у дереві")
+    memory.add_argument("--depth", type=int, default=3, help="глибина вкладеності каталогів")
+    memory.add_argument("--files-per-dir", type=int, default=100, help="файлів в одному каталозі")
+    memory.add_argument("--dir", help="робочий каталог (дерево зберігається між запусками)")
+    memory.set_defaults(func=bench_memory)
+
+    sync = commands.add_parser("sync", help="цикл синхронізації на синтетичному дереві")
+    sync.add_argument("--files", type=int, default=10000, help="кількість файлів у дереві (10000, 100000, 1000000)")
+    sync.add_argument("--depth", type=int, default=3, help="глибина вкладеності каталогів")
+    sync.add_argument("--files-per-dir", type=int, default=100, help="файлів в одному каталозі")
+    sync.add_argument("--cycles", type=int, default=20, help="кількість циклів синхронізації")
+    sync.add_argument("--adds", type=int, default=50, help="нових файлів за цикл")
+    sync.add_argument("--modifies", type=int, default=10, help="змінених файлів за цикл")
+    sync.add_argument("--deletes", type=int, default=10, help="видалених файлів за цикл")
+    sync.add_argument("--full-every", type=int, default=12, help="повний прохід кожні N циклів (0 - ніколи)")
+    sync.add_argument("--latency-ms", type=float, default=0.0, help="затримка одного запиту до fake Firebase")
+    sync.add_argument("--racy-window-ms", type=float, default=0.0,
+                      help="вікно недовіри до mtime каталогу (у програмі - 2000 мс)")
+    sync.add_argument("--settle-ms", type=float, default=0.0,
+                      help="період тиші перед публікацією файлу (у програмі - 2000 мс)")
+    sync.add_argument("--schema", choices=sorted(startMonitor.SCHEMA_VERSIONS), default="full",
+                      help="схема записів у Firebase")
+    sync.add_argument("--scan-workers", type=int, default=4)
+    sync.add_argument("--walk-workers", type=int, default=1, help="потоків обходу каталогів одного сканера")
+    sync.add_argument("--firebase-workers", type=int, default=8)
+    sync.add_argument("--dir", help="робочий каталог (дерево зберігається між запусками)")
+    sync.add_argument("--json", help="записати результати кожного циклу у JSON-файл")
+    sync.set_defaults(func=bench_sync)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
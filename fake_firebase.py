@@ -0,0 +1,148 @@
+# Локальна заміна Firebase Realtime Database в пам'яті процесу.
+# Повторює ту частину API firebase_admin.db, якою користується startMonitor,
+# і рахує кожне звернення до "сервера", щоб у тестах і бенчмарках можна було
+# перевіряти кількість мережевих запитів:
+#
+#     import fake_firebase, startMonitor
+#     startMonitor.db = fake_firebase.FakeDatabase()
+#     ...
+#     assert startMonitor.db.round_trips == 1
+import copy
+import itertools
+import json
+import threading
+import time
+
+def split_path(path):
+    return [part for part in (path or "").strip("/").split("/") if part]
+
+class FakeDatabase:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        # Поки True, кожен запит падає, як при обриві зв'язку
+        self.offline = False
+        self.root = {}
+        self.round_trips = 0
+        self.bytes_sent = 0
+        self.requests = []
+        self._lock = threading.Lock()
+        self._push_counter = itertools.count()
+
+    def reference(self, path="/", app=None):
+        return FakeReference(self, split_path(path))
+
+    def reset_counters(self):
+        with self._lock:
+            self.round_trips = 0
+            self.bytes_sent = 0
+            self.requests = []
+
+    def _request(self, method, parts, payload=None):
+        if self.offline:
+            raise ConnectionError("fake Firebase is offline")
+        with self._lock:
+            self.round_trips += 1
+            if payload is not None:
+                self.bytes_sent += len(json.dumps(payload))
+            self.requests.append((method, "/" + "/".join(parts)))
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get(self, parts):
+        node = self.root
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def _set(self, parts, value):
+        if not parts:
+            self.root = copy.deepcopy(value) if isinstance(value, dict) else {}
+            return
+
+        if value is None or value == {}:
+            # Як і в справжній базі, порожні батьківські вузли зникають разом з останнім дочірнім
+            trail = []
+            node = self.root
+            for part in parts[:-1]:
+                if not isinstance(node, dict) or part not in node:
+                    return
+                trail.append((node, part))
+                node = node[part]
+            if isinstance(node, dict):
+                node.pop(parts[-1], None)
+            for parent, part in reversed(trail):
+                if parent[part] == {}:
+                    del parent[part]
+            return
+
+        node = self.root
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = node[part] = {}
+            node = child
+        node[parts[-1]] = copy.deepcopy(value)
+
+    def next_push_key(self):
+        # Ключі впорядковані за часом створення, як і справжні push-ключі
+        return f"-fake{next(self._push_counter):015d}"
+
+class FakeReference:
+    def __init__(self, database, parts):
+        self._database = database
+        self._parts = parts
+
+    @property
+    def key(self):
+        return self._parts[-1] if self._parts else None
+
+    @property
+    def path(self):
+        return "/" + "/".join(self._parts)
+
+    def child(self, path):
+        return FakeReference(self._database, self._parts + split_path(path))
+
+    def get(self, etag=False, shallow=False):
+        self._database._request("get", self._parts)
+        with self._database._lock:
+            value = self._database._get(self._parts)
+            if shallow and isinstance(value, dict):
+                value = {key: True for key in value}
+            else:
+                value = copy.deepcopy(value)
+        return (value, "fake-etag") if etag else value
+
+    def set(self, value):
+        self._database._request("set", self._parts, value)
+        with self._database._lock:
+            self._database._set(self._parts, value)
+
+    def update(self, value):
+        if not value or not isinstance(value, dict):
+            raise ValueError("Value argument must be a non-empty dictionary.")
+        if None in value.keys():
+            raise ValueError("Dictionary must not contain None keys.")
+        self._database._request("update", self._parts, value)
+        with self._database._lock:
+            for path, child_value in value.items():
+                self._database._set(self._parts + split_path(path), child_value)
+
+    def push(self, value=""):
+        self._database._request("push", self._parts, value)
+        with self._database._lock:
+            key = self._database.next_push_key()
+            self._database._set(self._parts + [key], value)
+        return FakeReference(self._database, self._parts + [key])
+
+    def delete(self):
+        self._database._request("delete", self._parts)
+        with self._database._lock:
+            self._database._set(self._parts, None)
+
+default_database = FakeDatabase()
+
+def reference(path="/", app=None):
+    return default_database.reference(path, app)
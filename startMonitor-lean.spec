@@ -0,0 +1,83 @@
+# -*- mode: python ; coding: utf-8 -*-
+# Полегшена збірка: з Firebase SDK лише клієнт Realtime Database (firebase_admin.db + google-auth + requests).
+# Firestore, Storage, gRPC, protobuf і googleapiclient з requirements.txt програмі не потрібні.
+#
+#     pyinstaller startMonitor-lean.spec
+
+# firebase_admin імпортується відкладено (load_firebase), тож модулі клієнта вказуються явно
+hiddenimports = [
+    'firebase_admin',
+    'firebase_admin.credentials',
+    'firebase_admin.db',
+]
+
+excludes = [
+    'firebase_admin.firestore',
+    'firebase_admin.firestore_async',
+    'firebase_admin.storage',
+    'firebase_admin.messaging',
+    'firebase_admin.auth',
+    'firebase_admin.app_check',
+    'firebase_admin.functions',
+    'firebase_admin.instance_id',
+    'firebase_admin.ml',
+    'firebase_admin.project_management',
+    'firebase_admin.remote_config',
+    'firebase_admin.tenant_mgt',
+    'google.cloud',
+    'google.api_core',
+    'google.protobuf',
+    'google.rpc',
+    'google.type',
+    'google.longrunning',
+    'google.resumable_media',
+    'google_crc32c',
+    'googleapiclient',
+    'grpc',
+    'grpc_status',
+    'proto',
+    'httplib2',
+    'uritemplate',
+    'cachecontrol',
+    'msgpack',
+    'zstandard',
+    'unittest',
+    'pydoc',
+]
+
+a = Analysis(
+    ['startMonitor.py'],
+    pathex=[],
+    binaries=[],
+    datas=[],
+    hiddenimports=hiddenimports,
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=excludes,
+    noarchive=False,
+    optimize=0,
+)
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    a.binaries,
+    a.datas,
+    [],
+    name='startMonitor',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=True,
+    upx_exclude=[],
+    runtime_tmpdir=None,
+    console=False,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+    icon=['app.ico'],
+)
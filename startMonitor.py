@@ -1,21 +1,112 @@
 import os
+import sys
+import argparse
+import asyncio
+import signal
 import threading
 import time
 import json
+import pickle
 import re
-from tkinter import Tk, Label, Entry, Button, StringVar, messagebox, Toplevel, Text, Scrollbar, Frame, ttk
-import firebase_admin
-from firebase_admin import credentials, db
+import string
+import random
+import itertools
+import functools
+import logging
+import logging.handlers
+import sqlite3
+import errno
+import struct
+import traceback
+import ctypes
+import ctypes.util
+import bisect
+import hashlib
+from array import array
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+try:
+    from tkinter import Tk, Label, Entry, Button, StringVar, messagebox, Toplevel, Text, Scrollbar, Frame, ttk
+except ImportError:
+    # На серверах без Tk доступний лише режим --headless
+    Tk = Label = Entry = Button = StringVar = messagebox = Toplevel = Text = Scrollbar = Frame = ttk = None
 from datetime import datetime
 
 CONFIG_FILE = "config.json"
+STATE_FILE = os.path.join(os.path.dirname(CONFIG_FILE), "monitor_state.db")
 firebase_app = None
 database_ref = None
+# firebase_admin та його залежності (google-auth, requests, cryptography) завантажуються в load_firebase()
+firebase_admin = None
+credentials = None
+db = None
+firebase_import_lock = threading.Lock()
 monitoring_threads = {}
 stop_monitoring_flags = {}
 log_windows = {}
+# Кільцевий буфер останніх записів кожного вікна і черга записів для відображення в Tk.
+# Номер запису береться під log_lock разом з обома додаваннями, тож в обох чергах записи йдуть
+# у порядку номерів; віджети оновлює лише головний потік пакетами через root.after
+log_buffers = {}
+pending_logs = deque(maxlen=50000)
+log_sequence = itertools.count(1)
+log_lock = threading.Lock()
+log_pump_active = False
+log_max_lines = 2000
+log_buffer_lines = 2000
+log_flush_ms = 200
+log_console = True
+log_console_rate = 0
+console_lock = threading.Lock()
+console_window_start = 0.0
+console_lines = 0
+console_suppressed = 0
+file_logger = None
+# У процесі вікна (process_mode) записи журналу передаються в головний процес
+log_forward = None
 update_intervals = {}
 tracked_files = {}
+frequency_parsers = {}
+shared_frequency_parsers = {}
+default_frequency_parser = None
+frequency_rules = None
+frequency_cache_size = 4096
+shared_scanners = {}
+window_scanners = {}
+monitor_engine = None
+monitor_engine_lock = threading.Lock()
+scan_workers = 4
+firebase_workers = 8
+state_store = None
+state_store_lock = threading.Lock()
+watcher_backend = "auto"
+firebase_batch_max_paths = 500
+firebase_batch_max_bytes = 1024 * 1024
+full_rescan_seconds = 60.0
+outboxes = {}
+outbox_retry_base = 1.0
+outbox_retry_max = 300.0
+settle_queues = {}
+settle_seconds = 2.0
+walk_workers = 1
+window_walk_workers = {}
+min_intervals = {}
+max_intervals = {}
+min_update_interval = 1.0
+max_update_interval = 30.0
+firebase_schema = "full"
+window_schema_names = {}
+window_schemas = {}
+runtime_config = {}
+process_mode = False
+window_configs = {}
+window_processes = {}
+
+# Алфавіт і стан генератора push-ключів Firebase (ключі створюються локально, без запиту до сервера)
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+push_key_lock = threading.Lock()
+last_push_time = 0
+last_push_random = []
 
 def load_config():
     if os.path.exists(CONFIG_FILE):
@@ -27,9 +118,67 @@ def save_config(config):
     with open(CONFIG_FILE, "w") as file:
         json.dump(config, file, indent=4)
 
+def apply_runtime_config(config):
+    global watcher_backend, firebase_batch_max_paths, firebase_batch_max_bytes, full_rescan_seconds
+    global scan_workers, firebase_workers, outbox_retry_base, outbox_retry_max, settle_seconds, walk_workers
+    global min_update_interval, max_update_interval, io_budget, firebase_schema
+    global log_max_lines, log_buffer_lines, log_flush_ms, log_console, log_console_rate
+    global frequency_rules, frequency_cache_size, default_frequency_parser, runtime_config, process_mode
+    runtime_config = dict(config)
+    process_mode = bool(config.get("process_mode", False))
+    watcher_backend = config.get("watcher_backend", "auto")
+    firebase_batch_max_paths = int(config.get("firebase_batch_max_paths", 500))
+    firebase_batch_max_bytes = int(config.get("firebase_batch_max_bytes", 1024 * 1024))
+    full_rescan_seconds = float(config.get("full_rescan_seconds", 60.0))
+    scan_workers = int(config.get("scan_workers", 4))
+    firebase_workers = int(config.get("firebase_workers", 8))
+    outbox_retry_base = float(config.get("outbox_retry_base", 1.0))
+    outbox_retry_max = float(config.get("outbox_retry_max", 300.0))
+    settle_seconds = float(config.get("settle_seconds", 2.0))
+    walk_workers = max(1, int(config.get("walk_workers", 1)))
+    min_update_interval = float(config.get("min_update_interval", 1.0))
+    max_update_interval = float(config.get("max_update_interval", 30.0))
+    io_budget = IOBudget(float(config.get("io_budget", 0)))
+    firebase_schema = config.get("firebase_schema", "full")
+    log_max_lines = int(config.get("log_max_lines", 2000))
+    log_buffer_lines = int(config.get("log_buffer_lines", 2000))
+    log_flush_ms = int(config.get("log_flush_ms", 200))
+    log_console = bool(config.get("log_console", True))
+    log_console_rate = int(config.get("log_console_rate", 0))
+    configure_log_file(config.get("log_file"), int(config.get("log_file_max_bytes", 5 * 1024 * 1024)),
+                       int(config.get("log_file_backups", 3)))
+    frequency_rules = config.get("frequency_rules")
+    frequency_cache_size = int(config.get("frequency_cache_size", 4096))
+    shared_frequency_parsers.clear()
+    default_frequency_parser = build_frequency_parser("Global", frequency_rules)
+
+def load_firebase():
+    # Перше підключення, а не запуск програми, платить за імпорт Firebase SDK
+    global firebase_admin, credentials, db
+    with firebase_import_lock:
+        if firebase_admin is not None:
+            return
+        started = time.perf_counter()
+        import firebase_admin as admin
+        from firebase_admin import credentials as admin_credentials, db as admin_db
+        credentials = admin_credentials
+        # db може бути вже підмінений локальною базою (fake_firebase у бенчмарках)
+        if db is None:
+            db = admin_db
+        firebase_admin = admin
+    log_message("Global", f"Firebase SDK завантажено за {time.perf_counter() - started:.2f} сек")
+
+def preload_firebase():
+    # Імпорт у фоні, поки користувач заповнює форму; помилку покаже initialize_firebase
+    try:
+        load_firebase()
+    except ImportError:
+        pass
+
 def initialize_firebase(url, key_path):
     global firebase_app, database_ref
     try:
+        load_firebase()
         if firebase_app:
             firebase_admin.delete_app(firebase_app)
 
@@ -42,28 +191,762 @@ def initialize_firebase(url, key_path):
         log_message("Global", f"Помилка ініціалізації Firebase: {e}", error=True)
         return False
 
+def generate_push_key():
+    global last_push_time, last_push_random
+    with push_key_lock:
+        now = max(int(time.time() * 1000), last_push_time)
+        if now == last_push_time and last_push_random:
+            # Та сама мілісекунда - збільшуємо випадкову частину, щоб ключі лишались упорядкованими
+            i = len(last_push_random) - 1
+            while i >= 0 and last_push_random[i] == 63:
+                last_push_random[i] = 0
+                i -= 1
+            if i >= 0:
+                last_push_random[i] += 1
+        else:
+            last_push_time = now
+            last_push_random = [random.randrange(64) for _ in range(12)]
+
+        time_chars = []
+        for _ in range(8):
+            time_chars.append(PUSH_CHARS[now % 64])
+            now //= 64
+        return "".join(reversed(time_chars)) + "".join(PUSH_CHARS[i] for i in last_push_random)
+
+class FirebaseBatch:
+    def __init__(self):
+        self.updates = {}
+        # Зміни tracked_files цього циклу (None - файл більше не відстежується) для локального індексу
+        self.tracked_changes = {}
+
+    def __len__(self):
+        return len(self.updates)
+
+    def set(self, key, data):
+        self.updates[key] = data
+
+    def update_fields(self, key, fields):
+        merge_fields(self.updates, key, fields)
+
+    def delete(self, key):
+        self.updates[key] = None
+
+    def record(self, file_path, tracked):
+        self.tracked_changes[file_path] = tracked
+
+def chunk_updates(updates):
+    # Шляхи одного запису завжди потрапляють в один шматок
+    keys = []
+    chunk = {}
+    chunk_size = 0
+    for key, value in updates.items():
+        item = flatten_update(key, value)
+        item_size = len(key) + len(json.dumps(value))
+        if keys and (len(chunk) + len(item) > firebase_batch_max_paths or
+                     chunk_size + item_size > firebase_batch_max_bytes):
+            yield keys, chunk
+            keys = []
+            chunk = {}
+            chunk_size = 0
+        keys.append(key)
+        chunk.update(item)
+        chunk_size += item_size
+    if keys:
+        yield keys, chunk
+
+class Outbox:
+    # Зміни, які ще не підтвердив Firebase. Нова зміна ключа замінює попередню,
+    # тож після обриву зв'язку відправляється лише останній стан кожного файлу
+    def __init__(self, window_name):
+        self.window_name = window_name
+        self.base_path = f"/frequency/{window_name}"
+        self.pending = {}
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, updates):
+        # Повертає нові значення змінених ключів для збереження в локальному індексі
+        for key, value in updates.items():
+            if isinstance(value, RecordFields):
+                merge_fields(self.pending, key, value)
+            else:
+                self.pending[key] = value
+        return {key: self.pending[key] for key in updates if key in self.pending}
+
+    def due(self):
+        return bool(self.pending) and time.monotonic() >= self.retry_at
+
+    def wait_timeout(self, interval):
+        if not self.pending:
+            return interval
+        return min(interval, max(0.0, self.retry_at - time.monotonic()))
+
+    def backoff(self):
+        delay = min(outbox_retry_max, outbox_retry_base * 2 ** (self.failures - 1))
+        # Половина затримки випадкова, щоб вікна не поверталися до сервера одночасно
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def drain(self, engine, metrics=None):
+        # Черга йде multi-path update'ами; шматки завеликої черги відправляються паралельно
+        if not self.pending:
+            return 0
+        ref = db.reference(self.base_path)
+        chunks = list(chunk_updates(self.pending))
+
+        def send(chunk):
+            started = time.perf_counter()
+            try:
+                ref.update(chunk)
+            except Exception:
+                if metrics:
+                    metrics.error("firebase")
+                raise
+            if metrics:
+                metrics.observe("firebase_write_duration_seconds", time.perf_counter() - started)
+                metrics.increment("firebase_requests_total")
+
+        results = await asyncio.gather(*(engine.run_in_io(send, chunk) for _, chunk in chunks), return_exceptions=True)
+        sent = {}
+        errors = []
+        for (keys, _), result in zip(chunks, results):
+            if isinstance(result, Exception):
+                errors.append(result)
+            else:
+                sent.update((key, self.pending.pop(key)) for key in keys)
+
+        if sent:
+            store = get_state_store()
+            if store:
+                await engine.run_in_io(store.remove_outbox, self.window_name, list(sent))
+            deleted = sum(1 for value in sent.values() if value is None)
+            if metrics:
+                metrics.increment("records_uploaded_total", len(sent) - deleted)
+                metrics.increment("records_deleted_total", deleted)
+            log_message(self.window_name, f"Відправлено {len(sent)} змін у Firebase за {len(chunks) - len(errors)} запит(ів)")
+
+        if errors:
+            self.failures += 1
+            delay = self.backoff()
+            self.retry_at = time.monotonic() + delay
+            log_message(self.window_name, f"Помилка запису у Firebase: {errors[0]}. "
+                                          f"У черзі {len(self.pending)} змін, повтор через {delay:.1f} сек", error=True)
+        elif self.failures:
+            log_message(self.window_name, f"Зв'язок з Firebase відновлено після {self.failures} невдалих спроб")
+            self.failures = 0
+            self.retry_at = 0.0
+        return len(chunks)
+
+def get_outbox(window_name):
+    outbox = outboxes.get(window_name)
+    if outbox is None:
+        outbox = outboxes[window_name] = Outbox(window_name)
+    return outbox
+
+class RecordFields(dict):
+    # Часткове оновлення запису: у Firebase ідуть лише ці поля, а не весь запис
+    pass
+
+def merge_fields(updates, key, fields):
+    # Multi-path update не допускає вкладених шляхів, тож поля зливаються з уже запланованою зміною ключа
+    current = updates.get(key, RecordFields())
+    if current is None:
+        return
+    merged = type(current)(current)
+    merged.update(fields)
+    updates[key] = merged
+
+def flatten_update(key, value):
+    if isinstance(value, RecordFields):
+        return {f"{key}/{field}": item for field, item in value.items()}
+    return {key: value}
+
+SCHEMA_VERSIONS = {"full": 1, "compact": 2}
+
+SCHEMA_FIELDS = {
+    "full": {"frequency": "name", "file_path": "file_path", "last_modified": "last_modified", "timestamp": "timestamp"},
+    "compact": {"frequency": "f", "file_path": "p", "last_modified": "m", "timestamp": "t"},
+}
+
+class RecordSchema:
+    # Формат записів у /frequency/{вікно}: full (версія 1) - початковий, compact (версія 2) - короткі ключі,
+    # шлях відносно папки вікна і без status/window_name, які не змінюються
+    def __init__(self, name, window_name, root=None):
+        if name not in SCHEMA_VERSIONS:
+            raise ValueError(f"невідома схема записів '{name}'")
+        self.name = name
+        self.version = SCHEMA_VERSIONS[name]
+        self.window_name = window_name
+        self.root = root
+        self.names = SCHEMA_FIELDS[name]
+
+    @classmethod
+    def from_version(cls, version, window_name, root=None):
+        name = next((name for name, number in SCHEMA_VERSIONS.items() if number == version), "full")
+        return cls(name, window_name, root)
+
+    def path_value(self, file_path):
+        if self.name == "compact":
+            return os.path.relpath(file_path, self.root).replace(os.sep, "/")
+        return file_path
+
+    def record(self, file_path, frequency, last_modified, timestamp=None):
+        record = {
+            self.names["frequency"]: frequency,
+            self.names["file_path"]: self.path_value(file_path),
+            self.names["timestamp"]: time.time() if timestamp is None else timestamp,
+            self.names["last_modified"]: last_modified,
+        }
+        if self.name == "full":
+            record['status'] = 'active'
+            record['window_name'] = self.window_name
+        return record
+
+    def fields(self, file_path=None, frequency=None, last_modified=None):
+        # Лише змінені поля; час оновлення записується завжди
+        fields = RecordFields({self.names["timestamp"]: time.time()})
+        if file_path is not None:
+            fields[self.names["file_path"]] = self.path_value(file_path)
+        if frequency is not None:
+            fields[self.names["frequency"]] = frequency
+        if last_modified is not None:
+            fields[self.names["last_modified"]] = last_modified
+        return fields
+
+    def parse(self, record):
+        # Запис у будь-якій зі схем -> (абсолютний шлях, частота, mtime, timestamp) або None
+        source = SCHEMA_FIELDS["compact" if "p" in record else "full"]
+        file_path = record.get(source["file_path"])
+        if not isinstance(file_path, str):
+            return None
+        if source is SCHEMA_FIELDS["compact"]:
+            file_path = os.path.normpath(os.path.join(self.root, file_path))
+        return (file_path, record.get(source["frequency"]), record.get(source["last_modified"]),
+                record.get(source["timestamp"]))
+
+    def convert(self, record):
+        # Запис у будь-якій зі схем -> запис у цій схемі (для міграції; повторний запуск нічого не псує)
+        parsed = self.parse(record)
+        return self.record(*parsed) if parsed else None
+
+def get_record_schema(window_name):
+    schema = window_schemas.get(window_name)
+    if schema is None:
+        schema = window_schemas[window_name] = RecordSchema("full", window_name)
+    return schema
+
+class TrackedFile:
+    __slots__ = ('firebase_key', 'last_modified', 'frequency')
+
+    def __init__(self, firebase_key, last_modified, frequency):
+        self.firebase_key = firebase_key
+        self.last_modified = last_modified
+        self.frequency = sys.intern(frequency) if isinstance(frequency, str) else frequency
+
+def path_digest(file_path):
+    return int.from_bytes(hashlib.blake2b(file_path.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "little")
+
+class PathDigestSet:
+    # Початковий список файлів: 64-бітні дайджести шляхів у відсортованому масиві, 8 байт на файл
+    # замість рядка шляху в set; ймовірність хибного збігу для мільйона файлів ~3e-8
+    __slots__ = ('digests',)
+
+    def __init__(self, paths=(), digests=None):
+        self.digests = digests if digests is not None else array('Q', sorted(map(path_digest, paths)))
+
+    @classmethod
+    def from_bytes(cls, data):
+        digests = array('Q')
+        digests.frombytes(data)
+        return cls(digests=digests)
+
+    def to_bytes(self):
+        return self.digests.tobytes()
+
+    def _index(self, file_path):
+        digest = path_digest(file_path)
+        index = bisect.bisect_left(self.digests, digest)
+        return index if index < len(self.digests) and self.digests[index] == digest else -1
+
+    def __contains__(self, file_path):
+        return self._index(file_path) >= 0
+
+    def __len__(self):
+        return len(self.digests)
+
+    def difference_update(self, paths):
+        # Видалення з масиву зсуває хвіст, тож набір шляхів прибирається одним перебудуванням
+        dropped = set(map(path_digest, paths))
+        if dropped:
+            self.digests = array('Q', (digest for digest in self.digests if digest not in dropped))
+
+class StateStore:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS windows (
+                window_name TEXT PRIMARY KEY,
+                directory_path TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS tracked_files (
+                window_name TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                firebase_key TEXT NOT NULL,
+                frequency TEXT NOT NULL,
+                last_modified REAL NOT NULL,
+                PRIMARY KEY (window_name, file_path)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS outbox (
+                window_name TEXT NOT NULL,
+                firebase_key TEXT NOT NULL,
+                data TEXT,
+                partial INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (window_name, firebase_key)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS initial_files (
+                window_name TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                PRIMARY KEY (window_name, file_path)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS initial_digests (
+                window_name TEXT PRIMARY KEY,
+                digests BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS record_schemas (
+                window_name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            );
+        """)
+        # Індекси, створені до появи часткових оновлень, отримують нову колонку
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(outbox)")}
+        if "partial" not in columns:
+            self.connection.execute("ALTER TABLE outbox ADD COLUMN partial INTEGER NOT NULL DEFAULT 0")
+
+    def load_window(self, window_name, directory_path):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT directory_path FROM windows WHERE window_name = ?", (window_name,)).fetchone()
+            # Стан іншої папки не має сенсу відновлювати
+            if row is None or row[0] != directory_path:
+                return None
+            tracked = {
+                file_path: TrackedFile(firebase_key, last_modified, frequency)
+                for file_path, firebase_key, frequency, last_modified in self.connection.execute(
+                    "SELECT file_path, firebase_key, frequency, last_modified FROM tracked_files WHERE window_name = ?",
+                    (window_name,))
+            }
+            row = self.connection.execute(
+                "SELECT digests FROM initial_digests WHERE window_name = ?", (window_name,)).fetchone()
+            if row is not None:
+                return tracked, PathDigestSet.from_bytes(row[0])
+            # Індекси попередніх версій зберігали початковий список шляхами
+            return tracked, PathDigestSet(file_path for (file_path,) in self.connection.execute(
+                "SELECT file_path FROM initial_files WHERE window_name = ?", (window_name,)))
+
+    def load_keys(self, window_name, directory_path):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT directory_path FROM windows WHERE window_name = ?", (window_name,)).fetchone()
+            if row is None or row[0] != directory_path:
+                return set()
+            return {key for (key,) in self.connection.execute(
+                "SELECT firebase_key FROM tracked_files WHERE window_name = ?", (window_name,))}
+
+    def save_window(self, window_name, directory_path, tracked, initial_files):
+        with self.lock, self.connection:
+            # Черга невідправлених змін і версія схеми записів не залежать від знімка папки
+            for table in ("windows", "tracked_files", "initial_files", "initial_digests"):
+                self.connection.execute(f"DELETE FROM {table} WHERE window_name = ?", (window_name,))
+            self.connection.execute(
+                "INSERT INTO windows (window_name, directory_path) VALUES (?, ?)", (window_name, directory_path))
+            self.connection.execute(
+                "INSERT INTO initial_digests (window_name, digests) VALUES (?, ?)",
+                (window_name, initial_files.to_bytes()))
+            self.connection.executemany(
+                "INSERT INTO tracked_files VALUES (?, ?, ?, ?, ?)",
+                ((window_name, file_path, t.firebase_key, t.frequency, t.last_modified)
+                 for file_path, t in tracked.items()))
+
+    def save_changes(self, window_name, changes, updates=None):
+        # Усі зміни циклу разом із записами для Firebase фіксуються однією транзакцією до відправки
+        upserts = [(window_name, file_path, t.firebase_key, t.frequency, t.last_modified)
+                   for file_path, t in changes.items() if t is not None]
+        deletes = [(window_name, file_path) for file_path, t in changes.items() if t is None]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO tracked_files VALUES (?, ?, ?, ?, ?)", upserts)
+            self.connection.executemany(
+                "DELETE FROM tracked_files WHERE window_name = ? AND file_path = ?", deletes)
+            if updates:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO outbox (window_name, firebase_key, data, partial) VALUES (?, ?, ?, ?)",
+                    ((window_name, key, None if data is None else json.dumps(data), isinstance(data, RecordFields))
+                     for key, data in updates.items()))
+
+    def load_outbox(self, window_name):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT firebase_key, data, partial FROM outbox WHERE window_name = ?", (window_name,)).fetchall()
+        return {key: None if data is None else RecordFields(json.loads(data)) if partial else json.loads(data)
+                for key, data, partial in rows}
+
+    def load_schema(self, window_name):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT version FROM record_schemas WHERE window_name = ?", (window_name,)).fetchone()
+            return row[0] if row else None
+
+    def save_schema(self, window_name, version):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO record_schemas VALUES (?, ?)", (window_name, version))
+
+    def remove_outbox(self, window_name, keys):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "DELETE FROM outbox WHERE window_name = ? AND firebase_key = ?", ((window_name, key) for key in keys))
+
+    def _delete(self, window_name):
+        for table in ("windows", "tracked_files", "initial_files", "initial_digests", "outbox", "record_schemas"):
+            self.connection.execute(f"DELETE FROM {table} WHERE window_name = ?", (window_name,))
+
+    def delete_window(self, window_name):
+        with self.lock, self.connection:
+            self._delete(window_name)
+
+def get_state_store():
+    global state_store
+    with state_store_lock:
+        if state_store is None:
+            try:
+                state_store = StateStore(STATE_FILE)
+            except sqlite3.Error as e:
+                log_message("Global", f"Локальний індекс файлів недоступний: {e}", error=True)
+        return state_store
+
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HISTOGRAM_METRICS = {
+    "scan_duration_seconds": "Тривалість проходу сканера по папці вікна",
+    "diff_duration_seconds": "Час обробки подій циклу (різниця з відстежуваними файлами)",
+    "firebase_write_duration_seconds": "Затримка одного multi-path update у Firebase",
+    "firebase_delete_duration_seconds": "Затримка очищення даних вікна у Firebase",
+    "cycle_duration_seconds": "Повна тривалість циклу синхронізації вікна",
+    "settle_duration_seconds": "Час від виявлення файлу до його публікації після дописування",
+}
+
+COUNTER_METRICS = {
+    "scans_total": "Кількість проходів сканера",
+    "scan_dirs_visited_total": "Перевірено каталогів під час сканування",
+    "scan_files_stated_total": "Файлів, для яких виконано stat під час сканування",
+    "cycles_total": "Кількість циклів синхронізації",
+    "cycle_overruns_total": "Цикли або проходи сканера, довші за інтервал оновлення",
+    "records_uploaded_total": "Записів, відправлених у Firebase",
+    "records_deleted_total": "Записів, видалених з Firebase",
+    "firebase_requests_total": "Запитів до Firebase",
+    "settle_writes_avoided_total": "Проміжних записів файлів, які не відправлялися у Firebase",
+}
+
+GAUGE_METRICS = {
+    "tracked_files": "Кількість відстежуваних файлів",
+    "last_cycle_timestamp_seconds": "Час завершення останнього циклу (unix time)",
+    "scan_interval_seconds": "Поточний інтервал опитування папки (адаптивний)",
+}
+
+window_metrics = {}
+window_metrics_lock = threading.Lock()
+metrics_server = None
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(METRIC_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(METRIC_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        cumulative = list(itertools.accumulate(self.buckets))
+        return {
+            "buckets": {str(bound): cumulative[i] for i, bound in enumerate(METRIC_BUCKETS)},
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+class WindowMetrics:
+    # Оновлюється з потоків сканування і Firebase, читається інтерфейсом і HTTP-сервером
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {name: Histogram() for name in HISTOGRAM_METRICS}
+        self.counters = dict.fromkeys(COUNTER_METRICS, 0)
+        self.gauges = dict.fromkeys(GAUGE_METRICS, 0)
+        self.errors = {}
+        self.last = {}
+
+    def observe(self, name, value):
+        with self.lock:
+            self.histograms[name].observe(value)
+            self.last[name] = value
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def error(self, kind):
+        with self.lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "histograms": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "errors": dict(self.errors),
+                "last": dict(self.last),
+            }
+
+def get_window_metrics(window_name):
+    with window_metrics_lock:
+        metrics = window_metrics.get(window_name)
+        if metrics is None:
+            metrics = window_metrics[window_name] = WindowMetrics()
+        return metrics
+
+class ForwardedMetrics(WindowMetrics):
+    # Метрики в процесі вікна: кожна зміна застосовується до WindowMetrics головного процесу
+    def __init__(self, outgoing):
+        super().__init__()
+        self.outgoing = outgoing
+
+    def observe(self, name, value):
+        self.outgoing.append(("metric", "observe", (name, value)))
+
+    def increment(self, name, amount=1):
+        self.outgoing.append(("metric", "increment", (name, amount)))
+
+    def set_gauge(self, name, value):
+        self.outgoing.append(("metric", "set_gauge", (name, value)))
+
+    def error(self, kind):
+        self.outgoing.append(("metric", "error", (kind,)))
+
+def metrics_snapshot():
+    with window_metrics_lock:
+        windows = dict(window_metrics)
+    return {"timestamp": time.time(), "windows": {name: metrics.snapshot() for name, metrics in windows.items()}}
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def render_prometheus_metrics():
+    windows = sorted(metrics_snapshot()["windows"].items())
+    lines = []
+    for name, help_text in HISTOGRAM_METRICS.items():
+        metric = f"folder_monitor_{name}"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+        for window_name, snapshot in windows:
+            label = f'window="{escape_label(window_name)}"'
+            histogram = snapshot["histograms"][name]
+            for bound, count in histogram["buckets"].items():
+                lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {histogram["count"]}')
+            lines.append(f"{metric}_sum{{{label}}} {histogram['sum']}")
+            lines.append(f"{metric}_count{{{label}}} {histogram['count']}")
+    for kind, metrics_type, key in (("counter", COUNTER_METRICS, "counters"), ("gauge", GAUGE_METRICS, "gauges")):
+        for name, help_text in metrics_type.items():
+            metric = f"folder_monitor_{name}"
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            for window_name, snapshot in windows:
+                lines.append(f'{metric}{{window="{escape_label(window_name)}"}} {snapshot[key][name]}')
+    lines += ["# HELP folder_monitor_errors_total Помилки за видом", "# TYPE folder_monitor_errors_total counter"]
+    for window_name, snapshot in windows:
+        for kind, count in sorted(snapshot["errors"].items()):
+            lines.append(f'folder_monitor_errors_total{{window="{escape_label(window_name)}",kind="{kind}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+def format_metrics_summary(window_name):
+    with window_metrics_lock:
+        metrics = window_metrics.get(window_name)
+    if metrics is None:
+        return "Метрики: ще немає даних"
+    snapshot = metrics.snapshot()
+    last = snapshot["last"]
+    counters = snapshot["counters"]
+
+    def milliseconds(name):
+        return f"{last[name] * 1000:.0f} мс" if name in last else "-"
+
+    return (f"Файлів: {snapshot['gauges']['tracked_files']} | інтервал: {snapshot['gauges']['scan_interval_seconds']:.1f} с | "
+            f"скан: {milliseconds('scan_duration_seconds')} | "
+            f"цикл: {milliseconds('cycle_duration_seconds')} | запис: {milliseconds('firebase_write_duration_seconds')} | "
+            f"відправлено: {counters['records_uploaded_total']} | видалено: {counters['records_deleted_total']} | "
+            f"помилок: {sum(snapshot['errors'].values())} | перевищень інтервалу: {counters['cycle_overruns_total']}")
+
+def handle_metrics_request(handler):
+    path = handler.path.split("?", 1)[0]
+    if path == "/metrics":
+        body = render_prometheus_metrics().encode("utf-8")
+        content_type = "text/plain; version=0.0.4; charset=utf-8"
+    elif path == "/metrics.json":
+        body = json.dumps(metrics_snapshot(), ensure_ascii=False).encode("utf-8")
+        content_type = "application/json; charset=utf-8"
+    else:
+        handler.send_error(404)
+        return
+    handler.send_response(200)
+    handler.send_header("Content-Type", content_type)
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+def start_metrics_server(config):
+    global metrics_server
+    port = int(config.get("metrics_port", 0))
+    if metrics_server is not None or not port:
+        return
+    # За замовчуванням лише локальний інтерфейс: метрики містять назви вікон і папок
+    host = config.get("metrics_host", "127.0.0.1")
+    # http.server потрібен лише з увімкненими метриками, тож не сповільнює звичайний запуск
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        do_GET = handle_metrics_request
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        metrics_server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    except OSError as e:
+        log_message("Global", f"Не вдалося запустити сервер метрик на {host}:{port}: {e}", error=True)
+        return
+    metrics_server.daemon_threads = True
+    threading.Thread(target=metrics_server.serve_forever, daemon=True).start()
+    log_message("Global", f"Метрики доступні на http://{host}:{port}/metrics і /metrics.json")
+
 def clear_firebase_data(window_name):
     try:
         if database_ref:
-            db.reference(f"/frequency/{window_name}").delete()
+            started = time.perf_counter()
+            # Записи і версія схеми вікна видаляються одним multi-path update
+            db.reference("/").update({f"frequency/{window_name}": None, f"frequency_meta/{window_name}": None})
+            get_window_metrics(window_name).observe("firebase_delete_duration_seconds", time.perf_counter() - started)
             log_message("Global", f"Дані вікна {window_name} очищено успішно!")
             return True
     except Exception as e:
+        get_window_metrics(window_name).error("firebase")
         log_message("Global", f"Помилка при очищенні даних для {window_name}: {e}", error=True)
         return False
 
+def configure_log_file(path, max_bytes, backups):
+    global file_logger
+    if file_logger is not None:
+        for handler in list(file_logger.handlers):
+            file_logger.removeHandler(handler)
+            handler.close()
+        file_logger = None
+    if not path:
+        return
+    logger = logging.getLogger("folderMonitor")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    file_logger = logger
+
+def print_console(line):
+    global console_window_start, console_lines, console_suppressed
+    if not log_console:
+        return
+    if log_console_rate <= 0:
+        print(line)
+        return
+
+    # Не більше log_console_rate рядків на секунду, решта лише підраховується
+    with console_lock:
+        now = time.monotonic()
+        if now - console_window_start >= 1:
+            if console_suppressed:
+                print(f"... пропущено {console_suppressed} повідомлень у консолі")
+            console_window_start = now
+            console_lines = 0
+            console_suppressed = 0
+        if console_lines >= log_console_rate:
+            console_suppressed += 1
+            return
+        console_lines += 1
+    print(line)
+
 def log_message(window_name, message, error=False):
+    if log_forward is not None:
+        log_forward(window_name, message, error)
+        return
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     log_text = f"[{timestamp}] {message}"
+    tag = "error" if error else "info"
+    with log_lock:
+        sequence = next(log_sequence)
+        buffer = log_buffers.get(window_name)
+        if buffer is None:
+            buffer = log_buffers[window_name] = deque(maxlen=log_buffer_lines)
+        buffer.append((sequence, log_text, tag))
+        if log_pump_active:
+            pending_logs.append((window_name, sequence, log_text, tag))
 
-    if window_name in log_windows and log_windows[window_name].winfo_exists():
-        log_windows[window_name].text.configure(state='normal')
-        tag = "error" if error else "info"
-        log_windows[window_name].text.insert('end', log_text + "\n", tag)
-        log_windows[window_name].text.configure(state='disabled')
-        log_windows[window_name].text.see('end')
+    if file_logger is not None:
+        file_logger.log(logging.ERROR if error else logging.INFO, f"[{window_name}] {log_text}")
+    print_console(f"[{window_name}] {log_text}")
+
+def append_log_text(log_window, records):
+    chunks = []
+    for sequence, log_text, tag in records:
+        if sequence > log_window.last_sequence:
+            chunks.extend((log_text + "\n", tag))
+            log_window.last_sequence = sequence
+    if not chunks:
+        return
+
+    text = log_window.text
+    text.configure(state='normal')
+    text.insert('end', *chunks)
+    excess = int(text.index('end-1c').split('.')[0]) - 1 - log_max_lines
+    if excess > 0:
+        text.delete('1.0', f'{excess + 1}.0')
+    text.configure(state='disabled')
+    text.see('end')
+
+def drain_log_queue(root):
+    # Виконується лише в головному потоці: один insert на вікно за пакет записів
+    batches = {}
+    for _ in range(len(pending_logs)):
+        try:
+            window_name, sequence, log_text, tag = pending_logs.popleft()
+        except IndexError:
+            break
+        batches.setdefault(window_name, []).append((sequence, log_text, tag))
+
+    for window_name, records in batches.items():
+        if window_name in log_windows and log_windows[window_name].winfo_exists():
+            append_log_text(log_windows[window_name], records)
+
+    root.after(log_flush_ms, drain_log_queue, root)
 
-    print(f"[{window_name}] {log_text}")
+def start_log_pump(root):
+    global log_pump_active
+    log_pump_active = True
+    root.after(log_flush_ms, drain_log_queue, root)
 
 def create_log_window(window_name):
     if window_name not in log_windows or not log_windows[window_name].winfo_exists():
@@ -83,117 +966,1626 @@ def create_log_window(window_name):
 
         scrollbar.config(command=log_windows[window_name].text.yview)
 
-def extract_frequency_from_file(file_path):
-    try:
+        # Показуємо історію з кільцевого буфера; нові записи допише drain_log_queue
+        log_windows[window_name].last_sequence = 0
+        with log_lock:
+            history = list(log_buffers.get(window_name, ()))
+        append_log_text(log_windows[window_name], history)
+
+# Правила за замовчуванням: XXX.XXX або XXX,XXX, інакше перше число з 3-6 цифр (XXX -> XXX.000).
+# У config.json їх можна замінити ключем "frequency_rules" (глобально або для окремого вікна):
+# [{"pattern": "регулярний вираз", "format": "{1}.{2}", "missing": "000"}, ...],
+# де {N} - група N збігу, а "missing" підставляється замість групи, що не знайшлася
+DEFAULT_FREQUENCY_RULES = [
+    {"pattern": r"(\d{3})[.,](\d{3})", "format": "{1}.{2}"},
+    {"pattern": r"(\d{3})(\d{1,3})?", "format": "{1}.{2}", "missing": "000"},
+]
+
+def compile_frequency_template(template):
+    # "{1}.{2}" -> ("%s.%s", (1, 2)): форматування через % помітно швидше за str.format
+    parts = []
+    order = []
+    for literal, field_name, format_spec, conversion in string.Formatter().parse(template):
+        parts.append(literal.replace("%", "%%"))
+        if field_name is not None:
+            # Групи підставляються як є; {1:>3} чи {1!r} мовчки дали б інший результат, ніж у str.format
+            if format_spec or conversion:
+                raise ValueError(f"поле {{{field_name}}} у шаблоні {template} не підтримує форматування")
+            parts.append("%s")
+            order.append(int(field_name or 0))
+    return "".join(parts), tuple(order)
+
+class FrequencyParser:
+    def __init__(self, rules=None, cache_size=4096):
+        self.rules = []
+        for rule in (rules or DEFAULT_FREQUENCY_RULES):
+            pattern = re.compile(rule["pattern"])
+            template, order = compile_frequency_template(rule.get("format", "{0}"))
+            if max(order, default=0) > pattern.groups:
+                raise KeyError(f"шаблон {rule.get('format')} посилається на відсутню групу")
+            # Шаблон {1}.{2}... з групами по порядку підставляється без проміжного кортежу
+            sequential = order == tuple(range(1, pattern.groups + 1))
+            self.rules.append((pattern.search, template, order, sequential, rule.get("missing", "")))
+        # Стандартні правила розбираються двома regex напряму, без загального шаблону
+        default = not rules or rules == DEFAULT_FREQUENCY_RULES
+        self._parse_name = self._parse_default if default else self._parse_rules
+        # Сканер і так розбирає файл лише при появі чи зміні, тож кешуються тільки імена без частоти
+        # (службові й тимчасові файли, що з'являються знову й знову), і лише за базовим ім'ям
+        self.cache_size = cache_size
+        self.unmatched = set()
+
+    def parse(self, file_path):
         filename = os.path.splitext(os.path.basename(file_path))[0]
+        if filename in self.unmatched:
+            return None
+        frequency = self._parse_name(filename)
+        if frequency is None and self.cache_size > 0:
+            if len(self.unmatched) >= self.cache_size:
+                self.unmatched.clear()
+            self.unmatched.add(filename)
+        return frequency
 
-        # Пошук у форматі XXX.XXX або XXX,XXX
-        match = re.search(r'(\d{3})[.,](\d{3})', filename)
+    def _parse_default(self, filename):
+        # Однакові частоти багатьох файлів зберігаються одним рядком
+        match = self.rules[0][0](filename)
         if match:
-            return f"{match.group(1)}.{match.group(2)}"
-
-        # Пошук числа з 3 до 6 цифр
-        match = re.search(r'\d{3,6}', filename)
+            return sys.intern(match[1] + "." + match[2])
+        match = self.rules[1][0](filename)
         if match:
-            number = match.group(0)
-            if len(number) == 3:
-                return f"{number}.000"
-            else:
-                return f"{number[:3]}.{number[3:]}"
+            return sys.intern(match[1] + "." + (match[2] or "000"))
+        return None
+
+    def _parse_rules(self, filename):
+        for search, template, order, sequential, missing in self.rules:
+            match = search(filename)
+            if match:
+                if sequential:
+                    return sys.intern(template % match.groups(missing))
+                values = (match.group(0),) + match.groups(missing)
+                return sys.intern(template % tuple(values[i] for i in order))
+        return None
+
+def build_frequency_parser(window_name, rules):
+    # Вікна з однаковими правилами користуються одним розбірником і одним кешем
+    key = json.dumps(rules, sort_keys=True)
+    parser = shared_frequency_parsers.get(key)
+    if parser is None:
+        try:
+            parser = FrequencyParser(rules, frequency_cache_size)
+        except (re.error, KeyError, TypeError, ValueError) as e:
+            log_message(window_name, f"Некоректні правила frequency_rules ({e}), використовуються стандартні", error=True)
+            return build_frequency_parser(window_name, None)
+        shared_frequency_parsers[key] = parser
+    return parser
+
+def configure_window_parser(window_name, window_config):
+    rules = window_config.get("frequency_rules")
+    if rules:
+        frequency_parsers[window_name] = build_frequency_parser(window_name, rules)
+    else:
+        frequency_parsers.pop(window_name, None)
 
+def get_frequency_parser(window_name):
+    global default_frequency_parser
+    parser = frequency_parsers.get(window_name)
+    if parser is None:
+        if default_frequency_parser is None:
+            default_frequency_parser = build_frequency_parser("Global", frequency_rules)
+        parser = default_frequency_parser
+    return parser
+
+def extract_frequency_from_file(file_path, parser=None):
+    try:
+        return (parser or get_frequency_parser("Global")).parse(file_path)
     except Exception as e:
         log_message("Global", f"Помилка аналізу назви файлу {file_path}: {e}", error=True)
-
     return None
 
-def scan_directory_recursive(directory, existing_files=None):
-    frequencies = {}
-    if existing_files is None:
-        existing_files = set()
-    
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            file_path = os.path.join(root, file)
-            if file_path in existing_files:
+# Вважаємо mtime каталогу ненадійним, якщо він змінився менше ніж за 2 с до сканування
+# (грубі мітки часу FAT/SMB), і такий каталог перечитується при наступному проході
+RACY_MTIME_NS = 2 * 10**9
+
+ScanDiff = namedtuple("ScanDiff", ["added", "changed", "removed"])
+
+class IncrementalScanner:
+    def __init__(self, directory_path, workers=1):
+        self.directory_path = directory_path
+        self.workers = workers
+        self.executor = None
+        self.executor_workers = 0
+        # каталог -> [mtime_ns або None, {ім'я файлу: mtime}, {імена підкаталогів}]
+        self.directories = {}
+        self.dirs_visited = 0
+        self.dirs_listed = 0
+        self.files_stated = 0
+        self.scan_count = 0
+        self.last_scan_seconds = 0.0
+        self.lock = threading.RLock()
+
+    def iter_files(self, directory_path):
+        # Знімок файлів з кешу під вказаним каталогом (без звернень до диска)
+        key = os.path.normcase(directory_path)
+        prefix = os.path.join(key, "")
+        with self.lock:
+            result = []
+            for path, cached in self.directories.items():
+                norm = os.path.normcase(path)
+                if norm == key or norm.startswith(prefix):
+                    result.extend((os.path.join(path, name), mtime) for name, mtime in cached[1].items())
+            return result
+
+    def _ensure_directory(self, path):
+        cached = self.directories.get(path)
+        if cached is None:
+            cached = self.directories[path] = [None, {}, set()]
+            parent = os.path.dirname(path)
+            if path != self.directory_path and parent != path:
+                self._ensure_directory(parent)[2].add(os.path.basename(path))
+        return cached
+
+    def _drop(self, path):
+        self._forget(path, [])
+        parent = self.directories.get(os.path.dirname(path))
+        if parent is not None:
+            name = os.path.basename(path)
+            parent[1].pop(name, None)
+            parent[2].discard(name)
+
+    def note_events(self, events):
+        # Події inotify оновлюють кеш напряму, тож він лишається актуальним без проходів по диску
+        noted = []
+        with self.lock:
+            for event in events:
+                if event.kind == "rescan":
+                    self.scan(full=True)
+                    noted.append(event)
+                    continue
+                if event.kind in ("deleted", "moved"):
+                    self._drop(event.path)
+                if event.kind == "deleted":
+                    noted.append(event)
+                    continue
+
+                path = event.dest_path if event.kind == "moved" else event.path
+                last_modified = event.last_modified
+                if last_modified is None:
+                    try:
+                        last_modified = os.stat(path).st_mtime
+                    except OSError:
+                        self._drop(path)
+                        noted.append(FileEvent("deleted", event.path))
+                        continue
+                self._ensure_directory(os.path.dirname(path))[1][os.path.basename(path)] = last_modified
+                noted.append(event._replace(last_modified=last_modified))
+        return noted
+
+    def _forget(self, path, removed):
+        cached = self.directories.pop(path, None)
+        if cached is None:
+            return
+        for name in cached[1]:
+            removed.append(os.path.join(path, name))
+        for name in cached[2]:
+            self._forget(os.path.join(path, name), removed)
+
+    def scan(self, full=False):
+        with self.lock:
+            started = time.perf_counter()
+            diff = self._scan(full)
+            self.last_scan_seconds = time.perf_counter() - started
+            self.scan_count += 1
+            return diff
+
+    def _cached_mtime(self, path):
+        cached = self.directories.get(path)
+        return cached[0] if cached is not None else None
+
+    def _read_directory(self, path, mtime_ns, cached_mtime, full):
+        # Лише звернення до диска без доступу до кешу, тож у паралельному режимі виконується в пулі.
+        # (шлях, None, ...) - каталог зник; (шлях, mtime, None, None) - склад каталогу не змінився
+        if mtime_ns is None:
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                return path, None, None, None
+        if cached_mtime == mtime_ns and not full:
+            return path, mtime_ns, None, None
+
+        try:
+            with os.scandir(path) as iterator:
+                entries = list(iterator)
+        except OSError:
+            return path, None, None, None
+        files = {}
+        subdirs = {}
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs[entry.name] = entry.stat(follow_symlinks=False).st_mtime_ns
+                elif entry.is_file():
+                    files[entry.name] = entry.stat().st_mtime
+            except OSError:
                 continue
-                
-            frequency = extract_frequency_from_file(file_path)
-            if frequency:
-                frequencies[file_path] = {
-                    'frequency': frequency,
-                    'last_modified': os.path.getmtime(file_path)
-                }
-    return frequencies
-
-def sync_with_firebase(window_name, directory_path):
+        return path, mtime_ns, files, subdirs
+
+    def _walk_executor(self):
+        if self.workers <= 1:
+            return None
+        if self.executor is None or self.executor_workers != self.workers:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="walk")
+            self.executor_workers = self.workers
+        return self.executor
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def _scan(self, full):
+        added, changed, removed = {}, {}, []
+        self.dirs_visited = self.dirs_listed = self.files_stated = 0
+        racy_after = time.time_ns() - RACY_MTIME_NS
+
+        # mtime підкаталогів беремо зі stat батьківського scandir, якщо він перечитувався
+        walker = DirectoryWalker(self._read_directory, self._walk_executor(), self.workers)
+        walker.add(self.directory_path, None, self._cached_mtime(self.directory_path), full)
+        for path, mtime_ns, files, subdirs in walker:
+            self.dirs_visited += 1
+            if mtime_ns is None:
+                self._forget(path, removed)
+                continue
+
+            cached = self.directories.get(path)
+            if files is None:
+                # Склад каталогу не змінився - не перечитуємо його, лише перевіряємо підкаталоги
+                for name in cached[2]:
+                    child = os.path.join(path, name)
+                    walker.add(child, None, self._cached_mtime(child), full)
+                continue
+            self.dirs_listed += 1
+            self.files_stated += len(files)
+
+            old_files = cached[1] if cached is not None else {}
+            old_subdirs = cached[2] if cached is not None else set()
+            for name, mtime in files.items():
+                previous = old_files.get(name)
+                if previous is None:
+                    added[os.path.join(path, name)] = mtime
+                elif previous != mtime:
+                    changed[os.path.join(path, name)] = mtime
+            for name, child_mtime_ns in subdirs.items():
+                child = os.path.join(path, name)
+                walker.add(child, child_mtime_ns, self._cached_mtime(child), full)
+
+            for name in old_files.keys() - files.keys():
+                removed.append(os.path.join(path, name))
+            for name in old_subdirs - subdirs.keys():
+                self._forget(os.path.join(path, name), removed)
+            self.directories[path] = [mtime_ns if mtime_ns < racy_after else None, files, set(subdirs)]
+
+        return ScanDiff(added, changed, removed)
+
+class DirectoryWalker:
+    # Обхід дерева каталогів послідовно або обмеженим пулом потоків (для мережевих папок, де кожен
+    # readdir і stat - це запит по мережі). Результати віддаються в міру готовності,
+    # а знайдені підкаталоги додаються через add() прямо під час ітерації
+    def __init__(self, read, executor=None, workers=1):
+        self.read = read
+        self.executor = executor
+        self.workers = workers
+        self.queued = []
+        self.running = set()
+
+    def add(self, *args):
+        self.queued.append(args)
+
+    def __iter__(self):
+        if self.executor is None:
+            while self.queued:
+                yield self.read(*self.queued.pop())
+            return
+        while self.queued or self.running:
+            while self.queued and len(self.running) < self.workers:
+                self.running.add(self.executor.submit(self.read, *self.queued.pop()))
+            done, self.running = wait_futures(self.running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+def scan_diff_events(diff):
+    events = [FileEvent("deleted", path) for path in diff.removed]
+    events.extend(FileEvent("created", path, None, mtime) for path, mtime in diff.added.items())
+    events.extend(FileEvent("modified", path, None, mtime) for path, mtime in diff.changed.items())
+    return events
+
+# Події файлової системи, які бекенди спостереження передають у логіку синхронізації.
+# kind: created / modified / deleted / moved / rescan
+FileEvent = namedtuple("FileEvent", ["kind", "path", "dest_path", "last_modified"], defaults=[None, None])
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                      IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+
+async def wait_event(event, timeout):
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+class AdaptiveSchedule:
+    # Інтервал опитування: скорочується, поки надходять зміни, і поступово зростає до максимуму в простої
+    def __init__(self):
+        self.current = None
+
+    def next_delay(self, baseline, minimum, maximum):
+        if self.current is None:
+            self.current = baseline
+            # Перший інтервал зсунутий випадково, щоб проходи різних сканерів не збігалися в часі
+            return random.uniform(0, baseline)
+        self.current = min(max(self.current, minimum), maximum)
+        # Невеликий розкид на кожному циклі не дає сканерам знову вирівнятися
+        return self.current * random.uniform(0.9, 1.1)
+
+    def record(self, changed, baseline, minimum, maximum):
+        if self.current is None:
+            return
+        if changed:
+            self.current = max(minimum, min(self.current, baseline) / 2)
+        else:
+            self.current = min(maximum, self.current * 1.5)
+
+class IOBudget:
+    # Спільний для всіх вікон ліміт операцій з диском (каталогів і stat файлів) за секунду, 0 - без ліміту.
+    # Вартість проходу відома лише після нього, тож наступні проходи чекають, поки борг не погаситься
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, stopped):
+        if self.rate <= 0:
+            return
+        self._refill()
+        if self.tokens < 0:
+            await wait_event(stopped, -self.tokens / self.rate)
+
+    def spend(self, amount):
+        if self.rate <= 0:
+            return
+        self._refill()
+        self.tokens -= amount
+
+io_budget = IOBudget(0)
+
+class PollingWatcher:
+    name = "polling"
+
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self._last_full = time.monotonic()
+
+    async def read_events(self, engine, timeout, stopped):
+        # Зміна вмісту файлу не змінює mtime каталогу, тож повний прохід робиться щонайменше раз
+        # на full_rescan_seconds - за часом, бо в тиші адаптивний інтервал розтягує кожен цикл
+        if full_rescan_seconds > 0:
+            timeout = max(0, min(timeout, self._last_full + full_rescan_seconds - time.monotonic()))
+        if await wait_event(stopped, timeout):
+            return []
+        await io_budget.acquire(stopped)
+        if stopped.is_set():
+            return []
+        full = full_rescan_seconds > 0 and time.monotonic() - self._last_full >= full_rescan_seconds
+        if full:
+            self._last_full = time.monotonic()
+        return scan_diff_events(await engine.run_in_scan(self.scanner.scan, full))
+
+    def refresh(self):
+        return scan_diff_events(self.scanner.scan())
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    name = "inotify"
+
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self.directory_path = scanner.directory_path
+        self._watches = {}
+        self._last_full = time.monotonic()
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._libc.inotify_init1.argtypes = [ctypes.c_int]
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        try:
+            self._add_tree(self.directory_path)
+        except OSError:
+            os.close(self._fd)
+            raise
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), INOTIFY_WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            # Каталог міг зникнути між переліком і додаванням спостереження
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            raise OSError(err, f"inotify_add_watch {path}: {os.strerror(err)}")
+        self._watches[wd] = path
+        return True
+
+    def _add_tree(self, path):
+        # Повертає файли, які вже лежать у новому каталозі на момент додавання спостереження.
+        # Спостереження додається до переліку каталогу: файл, створений між ними, прийде подією
+        found = []
+        pending = [path]
+        while pending:
+            directory = pending.pop()
+            if not self._add_watch(directory):
+                continue
+            try:
+                with os.scandir(directory) as iterator:
+                    for entry in iterator:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        else:
+                            found.append(entry.path)
+            except OSError:
+                continue
+        return found
+
+    def _remove_tree(self, path):
+        prefix = path + os.sep
+        for wd, watched in list(self._watches.items()):
+            if watched == path or watched.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def _read_raw(self):
+        chunks = []
+        while True:
+            try:
+                chunk = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def read_events(self, engine, timeout, stopped):
+        # Дескриптор inotify чекаємо в циклі подій, а розбір (з обходом нових каталогів) - у пулі сканування.
+        # Раз на full_rescan_seconds - повний прохід на випадок подій, яких ядро не доставило
+        if full_rescan_seconds > 0:
+            timeout = max(0, min(timeout, self._last_full + full_rescan_seconds - time.monotonic()))
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        loop.add_reader(self._fd, lambda: readable.done() or readable.set_result(True))
+        stop_waiter = asyncio.ensure_future(stopped.wait())
+        try:
+            await asyncio.wait([readable, stop_waiter], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            loop.remove_reader(self._fd)
+            stop_waiter.cancel()
+        if stopped.is_set():
+            return []
+        events = await engine.run_in_scan(self.read_pending) if readable.done() else []
+        if full_rescan_seconds > 0 and time.monotonic() - self._last_full >= full_rescan_seconds:
+            self._last_full = time.monotonic()
+            events.extend(scan_diff_events(await engine.run_in_scan(self.scanner.scan, True)))
+        return events
+
+    def _add_new_tree(self, path, events):
+        # Без спостереження (наприклад, ENOSPC - вичерпано ліміт max_user_watches) каталог
+        # звіряється повним проходом, а вже розібрані події цього читання не губляться
+        try:
+            return self._add_tree(path)
+        except OSError:
+            if not any(event.kind == "rescan" for event in events):
+                events.append(FileEvent("rescan", self.directory_path))
+            return []
+
+    def read_pending(self):
+        data = self._read_raw()
+        events = []
+        moved_from = {}
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Черга ядра переповнена - частину подій втрачено, потрібне повне пересканування
+                self._add_new_tree(self.directory_path, events)
+                if not any(event.kind == "rescan" for event in events):
+                    events.append(FileEvent("rescan", self.directory_path))
+                continue
+
+            parent = self._watches.get(wd)
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            if parent is None or mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                continue
+
+            path = os.path.join(parent, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    events.extend(FileEvent("created", file) for file in self._add_new_tree(path, events))
+                elif mask & IN_MOVED_FROM:
+                    self._remove_tree(path)
+                    events.append(FileEvent("deleted", path))
+                elif mask & IN_DELETE:
+                    events.append(FileEvent("deleted", path))
+            elif mask & IN_MOVED_FROM:
+                moved_from[cookie] = len(events)
+                events.append(FileEvent("deleted", path))
+            elif mask & IN_MOVED_TO:
+                index = moved_from.pop(cookie, None)
+                if index is not None:
+                    events[index] = FileEvent("moved", events[index].path, path)
+                else:
+                    events.append(FileEvent("created", path))
+            elif mask & IN_CREATE:
+                events.append(FileEvent("created", path))
+            elif mask & IN_DELETE:
+                events.append(FileEvent("deleted", path))
+            elif mask & (IN_CLOSE_WRITE | IN_ATTRIB):
+                events.append(FileEvent("modified", path))
+        return events
+
+    def refresh(self):
+        # Кеш сканера оновлюється подіями, окремий прохід не потрібен
+        return []
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+def create_watcher(window_name, scanner):
+    backend = watcher_backend
+    if backend == "auto":
+        backend = "inotify" if sys.platform.startswith("linux") else "polling"
+
+    if backend == "inotify":
+        try:
+            return InotifyWatcher(scanner)
+        except (OSError, AttributeError) as e:
+            log_message(window_name, f"inotify недоступний ({e}), використовується опитування папки", error=True)
+    return PollingWatcher(scanner)
+
+class ScanSubscription:
+    def __init__(self, window_name, directory_path):
+        self.window_name = window_name
+        self.directory_path = directory_path
+        self.root = os.path.realpath(directory_path)
+        self.key = os.path.normcase(self.root)
+        self.prefix = os.path.join(self.key, "")
+        self.initial_files = PathDigestSet()
+        self.events = asyncio.Queue()
+        self.shared = None
+
+    def local_path(self, path):
+        # Шляхи сканера переводяться у шляхи відносно папки, яку вказав користувач для цього вікна
+        if path is None:
+            return None
+        norm = os.path.normcase(path)
+        if norm == self.key:
+            return self.directory_path
+        if norm.startswith(self.prefix):
+            return os.path.join(self.directory_path, path[len(self.prefix):])
+        return None
+
+    def translate(self, events):
+        result = []
+        for event in events:
+            if event.kind == "rescan":
+                result.append(FileEvent("rescan", self.directory_path))
+                continue
+            path = self.local_path(event.path)
+            if event.kind == "moved":
+                dest_path = self.local_path(event.dest_path)
+                if path and dest_path:
+                    result.append(event._replace(path=path, dest_path=dest_path))
+                elif path:
+                    result.append(FileEvent("deleted", path))
+                elif dest_path:
+                    result.append(FileEvent("created", dest_path, None, event.last_modified))
+            elif path:
+                result.append(event._replace(path=path))
+            elif event.kind == "deleted" and self.key.startswith(os.path.join(os.path.normcase(event.path), "")):
+                # Видалено один з батьківських каталогів папки вікна
+                result.append(FileEvent("deleted", self.directory_path))
+        return result
+
+    def snapshot(self):
+        files = {}
+        for path, mtime in self.shared.scanner.iter_files(self.root):
+            files[self.local_path(path)] = mtime
+        return files
+
+    def baseline(self):
+        return PathDigestSet(self.snapshot())
+
+    async def get_events(self, timeout):
+        try:
+            events = list(await asyncio.wait_for(self.events.get(), timeout))
+        except asyncio.TimeoutError:
+            return []
+        while True:
+            try:
+                events.extend(self.events.get_nowait())
+            except asyncio.QueueEmpty:
+                return events
+
+class SharedScanner:
+    def __init__(self, root):
+        self.root = root
+        self.key = os.path.normcase(root)
+        self.prefix = os.path.join(self.key, "")
+        self.scanner = IncrementalScanner(root)
+        self.subscriptions = {}
+        self.stopped = asyncio.Event()
+        self.watcher = None
+        self.task = None
+        self.schedule = AdaptiveSchedule()
+
+    def covers(self, key):
+        return key == self.key or key.startswith(self.prefix)
+
+    def interval(self):
+        return min((update_intervals.get(window_name, 5) for window_name in list(self.subscriptions)), default=5)
+
+    def interval_bounds(self):
+        # Базовий інтервал - найменший update_interval серед вікон; межі - найсуворіші з їхніх налаштувань
+        window_names = list(self.subscriptions)
+        baseline = self.interval()
+        minimum = min((min_intervals.get(name, min_update_interval) for name in window_names), default=min_update_interval)
+        maximum = min((max_intervals.get(name, max_update_interval) for name in window_names), default=max_update_interval)
+        return baseline, min(minimum, baseline), max(maximum, baseline)
+
+    def update_workers(self, window_names=None):
+        # Спільний прохід іде з найбільшою паралельністю серед вікон, які він обслуговує
+        window_names = list(self.subscriptions) if window_names is None else window_names
+        self.scanner.workers = max((window_walk_workers.get(name, walk_workers) for name in window_names), default=walk_workers)
+
+    def start(self, window_name):
+        # Спостереження вмикаємо до першого проходу, щоб не пропустити файли між ними
+        self.update_workers([window_name])
+        self.watcher = create_watcher(window_name, self.scanner)
+        self.scanner.scan()
+
+    def stop(self):
+        self.stopped.set()
+
+    def dispatch(self, events):
+        if not events:
+            return
+        for subscription in list(self.subscriptions.values()):
+            if subscription.shared is not self:
+                continue
+            translated = subscription.translate(events)
+            if translated:
+                subscription.events.put_nowait(translated)
+
+    def refresh(self):
+        return self.scanner.note_events(self.watcher.refresh())
+
+    def record_scan(self):
+        # Прохід спільний, тож його показники записуються кожному вікну, яке він обслуговує
+        scanner = self.scanner
+        overrun = scanner.last_scan_seconds > self.interval()
+        io_budget.spend(scanner.dirs_visited + scanner.files_stated)
+        for window_name in list(self.subscriptions):
+            metrics = get_window_metrics(window_name)
+            metrics.set_gauge("scan_interval_seconds", self.schedule.current or self.interval())
+            metrics.observe("scan_duration_seconds", scanner.last_scan_seconds)
+            metrics.increment("scans_total")
+            metrics.increment("scan_dirs_visited_total", scanner.dirs_visited)
+            metrics.increment("scan_files_stated_total", scanner.files_stated)
+            if overrun:
+                metrics.increment("cycle_overruns_total")
+
+    async def run(self, engine):
+        scans_recorded = 0
+        try:
+            while not self.stopped.is_set():
+                try:
+                    bounds = self.interval_bounds()
+                    events = await self.watcher.read_events(engine, self.schedule.next_delay(*bounds), self.stopped)
+                    self.schedule.record(bool(events), *bounds)
+                    if self.scanner.scan_count != scans_recorded:
+                        scans_recorded = self.scanner.scan_count
+                        self.record_scan()
+                    if events and not self.stopped.is_set():
+                        self.dispatch(await engine.run_in_scan(self.scanner.note_events, events))
+                except Exception as e:
+                    for window_name in list(self.subscriptions):
+                        get_window_metrics(window_name).error("scan")
+                        log_message(window_name, f"Помилка сканування {self.root}: {e}", error=True)
+                    await wait_event(self.stopped, self.interval())
+        finally:
+            self.watcher.close()
+            self.scanner.close()
+
+async def subscribe_scanner(engine, window_name, directory_path):
+    subscription = ScanSubscription(window_name, directory_path)
+    async with engine.registry_lock:
+        shared = next((s for s in shared_scanners.values() if s.covers(subscription.key)), None)
+        if shared is None:
+            shared = SharedScanner(subscription.root)
+            await engine.run_in_scan(shared.start, window_name)
+            # Вже запущені сканери вкладених папок поглинаються новим - одне дерево, один прохід
+            for child in [s for s in shared_scanners.values() if shared.covers(s.key)]:
+                del shared_scanners[child.key]
+                child.stop()
+                for child_subscription in list(child.subscriptions.values()):
+                    child_subscription.shared = shared
+                    shared.subscriptions[child_subscription.window_name] = child_subscription
+                    window_scanners[child_subscription.window_name] = shared
+                    child_subscription.events.put_nowait([FileEvent("rescan", child_subscription.directory_path)])
+            shared_scanners[shared.key] = shared
+        else:
+            shared.dispatch(await engine.run_in_scan(shared.refresh))
+
+        subscription.shared = shared
+        subscription.initial_files = await engine.run_in_scan(subscription.baseline)
+        shared.subscriptions[window_name] = subscription
+        window_scanners[window_name] = shared
+        shared.update_workers()
+        # Сканер запускаємо після підписки, щоб перший інтервал уже враховував налаштування вікна
+        if shared.task is None:
+            shared.task = asyncio.ensure_future(shared.run(engine))
+    return subscription
+
+async def unsubscribe_scanner(engine, window_name):
+    async with engine.registry_lock:
+        shared = window_scanners.pop(window_name, None)
+        if shared is None:
+            return
+        shared.subscriptions.pop(window_name, None)
+        shared.update_workers()
+        # Сканер зупиняється, коли від нього відписалося останнє вікно
+        if not shared.subscriptions:
+            shared_scanners.pop(shared.key, None)
+            shared.stop()
+
+def track_file(window_name, batch, file_path, frequency, last_modified):
+    files = tracked_files[window_name]
+    tracked = files.get(file_path)
+    if tracked is not None and last_modified <= tracked.last_modified:
+        return
+
+    schema = get_record_schema(window_name)
+    if tracked is None:
+        tracked = files[file_path] = TrackedFile(generate_push_key(), last_modified, frequency)
+        batch.set(tracked.firebase_key, schema.record(file_path, frequency, last_modified))
+    else:
+        # В існуючому записі оновлюються лише поля, що змінилися
+        batch.update_fields(tracked.firebase_key, schema.fields(
+            frequency=frequency if frequency != tracked.frequency else None, last_modified=last_modified))
+        tracked.last_modified = last_modified
+        tracked.frequency = frequency
+    batch.record(file_path, tracked)
+
+    log_message(window_name, f"Оновлено частоту: {frequency} (файл: {file_path})")
+
+def untrack_file(window_name, batch, file_path):
+    get_settle_queue(window_name).discard(file_path)
+    tracked = tracked_files[window_name].pop(file_path, None)
+    if tracked is None:
+        return
+    batch.delete(tracked.firebase_key)
+    batch.record(file_path, None)
+    log_message(window_name, f"Видалено частоту: {tracked.frequency} (файл: {file_path})")
+
+def untrack_path(window_name, batch, path):
+    # Шлях може бути як файлом, так і видаленим каталогом з відстежуваними файлами
+    get_settle_queue(window_name).discard(path)
+    untrack_file(window_name, batch, path)
+    prefix = path + os.sep
+    for file_path in [p for p in tracked_files[window_name] if p.startswith(prefix)]:
+        untrack_file(window_name, batch, file_path)
+
+def refresh_file(window_name, batch, file_path, initial_files, last_modified=None):
+    if file_path in initial_files:
+        return
+    frequency = extract_frequency_from_file(file_path, get_frequency_parser(window_name))
+    if not frequency:
+        untrack_file(window_name, batch, file_path)
+        return
+    if last_modified is None:
+        try:
+            last_modified = os.path.getmtime(file_path)
+        except OSError:
+            untrack_file(window_name, batch, file_path)
+            return
+    tracked = tracked_files[window_name].get(file_path)
+    if tracked is not None and last_modified <= tracked.last_modified:
+        return
+    # Файл, у який ще пишуть, публікується один раз - після того як допишеться
+    if get_settle_queue(window_name).hold(file_path, frequency, last_modified):
+        return
+    track_file(window_name, batch, file_path, frequency, last_modified)
+
+def rename_tracked_file(window_name, batch, src_path, dest_path, initial_files):
+    files = tracked_files[window_name]
+    frequency = extract_frequency_from_file(dest_path, get_frequency_parser(window_name))
+    if src_path not in files or dest_path in files or dest_path in initial_files or not frequency:
+        untrack_path(window_name, batch, src_path)
+        refresh_file(window_name, batch, dest_path, initial_files)
+        return
+
+    # Перейменований файл зберігає свій ключ у Firebase
+    try:
+        last_modified = os.path.getmtime(dest_path)
+    except OSError:
+        untrack_file(window_name, batch, src_path)
+        return
+    tracked = files.pop(src_path)
+    files[dest_path] = tracked
+    batch.update_fields(tracked.firebase_key, get_record_schema(window_name).fields(
+        file_path=dest_path,
+        frequency=frequency if frequency != tracked.frequency else None,
+        last_modified=last_modified if last_modified != tracked.last_modified else None))
+    tracked.last_modified = last_modified
+    tracked.frequency = frequency
+    batch.record(src_path, None)
+    batch.record(dest_path, tracked)
+    log_message(window_name, f"Перейменовано файл: {src_path} -> {dest_path} (частота: {frequency})")
+
+def resync_window(window_name, batch, subscription, initial_files):
+    # Звірка з кешем сканера після втрати подій або переходу на спільний сканер батьківської папки
+    current_files = subscription.snapshot()
+    log_message(window_name, f"Повна звірка: {len(current_files)} файлів у папці")
+    for file_path, last_modified in current_files.items():
+        refresh_file(window_name, batch, file_path, initial_files, last_modified)
+    for file_path in [p for p in tracked_files[window_name] if p not in current_files]:
+        untrack_file(window_name, batch, file_path)
+
+class SettlingFile:
+    __slots__ = ('signature', 'first_seen', 'stable_since', 'writes', 'frequency', 'last_modified')
+
+    def __init__(self, signature, now, frequency, last_modified):
+        # signature - (розмір, mtime_ns); writes - пропущені проміжні записи
+        self.signature = signature
+        self.first_seen = now
+        self.stable_since = now
+        self.writes = 0
+        self.frequency = frequency
+        self.last_modified = last_modified
+
+    def changed(self, signature, now, last_modified):
+        self.signature = signature
+        self.stable_since = now
+        self.writes += 1
+        self.last_modified = last_modified
+
+class SettleQueue:
+    # Файли, у які ще пишуть: публікуються, коли розмір і mtime не змінювалися quiet секунд
+    def __init__(self, window_name, quiet):
+        self.window_name = window_name
+        self.quiet = quiet
+        # шлях -> SettlingFile
+        self.pending = {}
+
+    def __len__(self):
+        return len(self.pending)
+
+    def hold(self, file_path, frequency, last_modified):
+        # True, якщо файл відкладено; файл, mtime якого старший за період тиші, вже дописаний
+        if self.quiet <= 0:
+            return False
+        entry = self.pending.get(file_path)
+        if entry is None and time.time() - last_modified >= self.quiet:
+            return False
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            self.pending.pop(file_path, None)
+            return True
+        now = time.monotonic()
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if entry is None:
+            self.pending[file_path] = SettlingFile(signature, now, frequency, stat.st_mtime)
+        elif entry.signature != signature:
+            entry.changed(signature, now, stat.st_mtime)
+            entry.frequency = frequency
+        return True
+
+    def discard(self, path):
+        self.pending.pop(path, None)
+        prefix = path + os.sep
+        for file_path in [p for p in self.pending if p.startswith(prefix)]:
+            del self.pending[file_path]
+
+    def deadline(self):
+        return min(entry.stable_since for entry in self.pending.values()) + self.quiet
+
+    def due(self):
+        return bool(self.pending) and time.monotonic() >= self.deadline()
+
+    def wait_timeout(self, interval):
+        if not self.pending:
+            return interval
+        return min(interval, max(0.0, self.deadline() - time.monotonic()))
+
+    def collect(self):
+        # Файли, що простояли без змін період тиші, ще раз перевіряються stat перед публікацією
+        now = time.monotonic()
+        ready = []
+        for file_path, entry in list(self.pending.items()):
+            if now < entry.stable_since + self.quiet:
+                continue
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                del self.pending[file_path]
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if signature != entry.signature:
+                entry.changed(signature, now, stat.st_mtime)
+                continue
+            del self.pending[file_path]
+            ready.append((file_path, entry.frequency, entry.last_modified, now - entry.first_seen, entry.writes))
+        return ready
+
+def get_settle_queue(window_name):
+    queue = settle_queues.get(window_name)
+    if queue is None:
+        queue = settle_queues[window_name] = SettleQueue(window_name, settle_seconds)
+    return queue
+
+def publish_settled(window_name, batch, initial_files):
+    settle = get_settle_queue(window_name)
+    if not settle.due():
+        return
+    ready = settle.collect()
+    if not ready:
+        return
+    metrics = get_window_metrics(window_name)
+    avoided = 0
+    for file_path, frequency, last_modified, settle_time, writes in ready:
+        metrics.observe("settle_duration_seconds", settle_time)
+        avoided += writes
+        if file_path not in initial_files:
+            track_file(window_name, batch, file_path, frequency, last_modified)
+    metrics.increment("settle_writes_avoided_total", avoided)
+    log_message(window_name, f"Дописано {len(ready)} файл(ів), очікування в середньому "
+                             f"{sum(item[3] for item in ready) / len(ready):.1f} сек, пропущено проміжних записів: {avoided}")
+
+def apply_file_events(window_name, batch, subscription, events, initial_files):
+    for event in events:
+        if event.kind == "rescan":
+            resync_window(window_name, batch, subscription, initial_files)
+        elif event.kind == "deleted":
+            untrack_path(window_name, batch, event.path)
+        elif event.kind == "moved":
+            rename_tracked_file(window_name, batch, event.path, event.dest_path, initial_files)
+        else:
+            refresh_file(window_name, batch, event.path, initial_files, event.last_modified)
+    publish_settled(window_name, batch, initial_files)
+
+async def commit_batch(engine, window_name, batch):
+    # Спершу зміни фіксуються в локальному індексі й черзі, і лише потім ідуть у Firebase:
+    # невдала відправка залишається в черзі й повторюється, а не губиться
+    outbox = get_outbox(window_name)
+    queued = outbox.add(batch.updates)
+    store = get_state_store()
+    if store and (batch.tracked_changes or queued):
+        await engine.run_in_io(store.save_changes, window_name, batch.tracked_changes, queued)
+    if outbox.due():
+        await outbox.drain(engine, get_window_metrics(window_name))
+
+async def restore_outbox(engine, window_name):
+    store = get_state_store()
+    if store is None:
+        return
+    outbox = get_outbox(window_name)
+    outbox.add(await engine.run_in_io(store.load_outbox, window_name))
+    if outbox:
+        log_message(window_name, f"У черзі з минулого запуску {len(outbox)} невідправлених змін")
+
+async def prepare_record_schema(engine, window_name, directory_path):
+    # Версія схеми записів вікна зберігається в /frequency_meta/{вікно}/schema; дані без неї - версія 1
+    target = RecordSchema(window_schema_names.get(window_name, firebase_schema), window_name, directory_path)
+    store = get_state_store()
+    meta = db.reference(f"/frequency_meta/{window_name}")
+    try:
+        version = await engine.run_in_io(meta.child("schema").get)
+        if version is None:
+            existing = await engine.run_in_io(functools.partial(db.reference(f"/frequency/{window_name}").get, shallow=True))
+            version = 1 if existing else target.version
+            if not existing:
+                await engine.run_in_io(meta.update, {"schema": target.version})
+    except Exception as e:
+        version = (await engine.run_in_io(store.load_schema, window_name) if store else None) or 1
+        log_message(window_name, f"Не вдалося перевірити версію схеми записів ({e}), використовується версія {version}", error=True)
+        window_schemas[window_name] = RecordSchema.from_version(version, window_name, directory_path)
+        return
+
+    if version != target.version:
+        version = await migrate_records(engine, window_name, target, version)
+    window_schemas[window_name] = RecordSchema.from_version(version, window_name, directory_path)
+    if store:
+        await engine.run_in_io(store.save_schema, window_name, version)
+
+async def migrate_records(engine, window_name, target, version):
+    # Зміни з черги записані в старій схемі, тож спершу вони мають дійти до сервера
+    outbox = get_outbox(window_name)
+    await outbox.drain(engine, get_window_metrics(window_name))
+    if outbox:
+        log_message(window_name, f"Міграцію записів на схему {target.name} відкладено: у черзі {len(outbox)} змін", error=True)
+        return version
+
+    try:
+        records = await engine.run_in_io(db.reference(f"/frequency/{window_name}").get) or {}
+        converted = {}
+        for key, record in records.items():
+            if isinstance(record, dict):
+                record = target.convert(record)
+                if record is not None:
+                    converted[key] = record
+        ref = db.reference(f"/frequency/{window_name}")
+        chunks = list(chunk_updates(converted))
+        await asyncio.gather(*(engine.run_in_io(ref.update, chunk) for _, chunk in chunks))
+        # Версія змінюється лише після того, як усі записи переписані
+        await engine.run_in_io(db.reference(f"/frequency_meta/{window_name}").update,
+                               {"schema": target.version, "migrated_at": time.time()})
+    except Exception as e:
+        log_message(window_name, f"Помилка міграції записів з версії {version} на {target.version}: {e}", error=True)
+        return version
+    log_message(window_name, f"Записи мігровано з версії {version} на {target.version} ({target.name}): "
+                             f"{len(converted)} записів за {len(chunks)} запит(ів)")
+    return target.version
+
+def record_path_key(file_path):
+    return os.path.normcase(os.path.normpath(file_path))
+
+def reconcile_records(window_name, batch, subscription, remote_keys, records):
+    # Записи на сервері, яких немає в локальному стані: існуючий файл переймає свій старий ключ,
+    # решта (видалені файли, дублікати одного шляху) прибирається тим самим пакетом
+    files = tracked_files[window_name]
+    schema = get_record_schema(window_name)
+    parser = get_frequency_parser(window_name)
+    snapshot = subscription.snapshot()
+    current = {record_path_key(file_path): file_path for file_path in snapshot}
+    claimed = {record_path_key(file_path) for file_path in files}
+    local_keys = {tracked.firebase_key for tracked in files.values()}
+    adopted = orphans = reuploaded = 0
+    released = []
+    # Push-ключі впорядковані за часом створення, тож із дублікатів лишається найстаріший
+    for key in sorted(records):
+        record = records[key]
+        if key in local_keys or not isinstance(record, dict):
+            continue
+        parsed = schema.parse(record)
+        if parsed is None:
+            continue
+        file_path, frequency, last_modified, timestamp = parsed
+        path_key = record_path_key(file_path)
+        local_path = current.get(path_key)
+        local_frequency = extract_frequency_from_file(local_path, parser) if local_path else None
+        if local_path is None or path_key in claimed or not local_frequency:
+            batch.delete(key)
+            orphans += 1
+            continue
+        # Стан береться з файлу на диску; застарілий або неповний запис перезаписується під тим самим ключем
+        tracked = files[local_path] = TrackedFile(key, snapshot[local_path], local_frequency)
+        if frequency != tracked.frequency or last_modified != tracked.last_modified:
+            batch.set(key, schema.record(local_path, tracked.frequency, tracked.last_modified, timestamp))
+            reuploaded += 1
+        batch.record(local_path, tracked)
+        released.append(local_path)
+        claimed.add(path_key)
+        adopted += 1
+
+    subscription.initial_files.difference_update(released)
+
+    # Записи, яких уже немає на сервері (вузол очистили вручну), відправляються повністю
+    for file_path, tracked in files.items():
+        if tracked.firebase_key not in remote_keys:
+            batch.set(tracked.firebase_key, schema.record(file_path, tracked.frequency, tracked.last_modified))
+            reuploaded += 1
+    if adopted or orphans or reuploaded:
+        log_message(window_name, f"Звірка з Firebase: {len(remote_keys)} записів на сервері, перейнято {adopted}, "
+                                 f"до видалення {orphans}, повторно відправлено {reuploaded}")
+    return adopted
+
+async def fetch_remote_records(engine, window_name, local_keys):
+    # Спершу лише ключі (shallow); повні записи читаються одним запитом,
+    # тільки якщо на сервері є ключі, невідомі локальному стану
+    ref = db.reference(f"/frequency/{window_name}")
+    outbox = get_outbox(window_name)
+    try:
+        remote_keys = set(await engine.run_in_io(functools.partial(ref.get, shallow=True)) or ())
+        # Записи, видалення яких ще чекає в черзі, не переймаються знову
+        remote_keys = {key for key in remote_keys if key not in outbox.pending or outbox.pending[key] is not None}
+        records = await engine.run_in_io(ref.get) if remote_keys - local_keys else None
+    except Exception as e:
+        log_message(window_name, f"Звірку з Firebase пропущено: {e}", error=True)
+        return None
+    return remote_keys, {key: record for key, record in (records or {}).items() if key in remote_keys}
+
+async def reconcile_remote(engine, window_name, batch, subscription):
+    local_keys = {tracked.firebase_key for tracked in tracked_files[window_name].values()}
+    remote = await engine.fetch_remote(window_name, local_keys)
+    if remote is None:
+        return 0
+    return await engine.run_in_scan(reconcile_records, window_name, batch, subscription, *remote)
+
+async def restore_window_state(engine, window_name, directory_path, subscription):
+    store = get_state_store()
+    stored = await engine.run_in_io(store.load_window, window_name, directory_path) if store else None
+    if stored is not None:
+        # Теплий перезапуск: ключі Firebase і початковий список беремо з індексу
+        tracked_files[window_name], subscription.initial_files = stored
+        log_message(window_name, f"Відновлено стан з {STATE_FILE}: {len(stored[0])} відстежуваних файлів")
+
+    batch = FirebaseBatch()
+    adopted = await reconcile_remote(engine, window_name, batch, subscription)
+    if stored is not None or adopted:
+        # Одним проходом звіряємо відстежувані файли з поточним вмістом папки
+        await engine.run_in_scan(resync_window, window_name, batch, subscription, subscription.initial_files)
+    await engine.commit(window_name, batch)
+    if store and (stored is None or adopted):
+        await engine.save_state(window_name, directory_path, subscription)
+
+def configure_window(window_name, window_config):
+    configure_window_parser(window_name, window_config)
+    get_settle_queue(window_name).quiet = float(window_config.get("settle_seconds", settle_seconds))
+    window_walk_workers[window_name] = max(1, int(window_config.get("walk_workers", walk_workers)))
+    min_intervals[window_name] = float(window_config.get("min_update_interval", min_update_interval))
+    max_intervals[window_name] = float(window_config.get("max_update_interval", max_update_interval))
+    window_schema_names[window_name] = window_config.get("firebase_schema", firebase_schema)
+    window_configs[window_name] = dict(window_config)
+
+async def sync_with_firebase(engine, window_name, directory_path):
     global stop_monitoring_flags, update_intervals, tracked_files
 
     if window_name not in tracked_files:
         tracked_files[window_name] = {}
 
-    # При першому запуску отримуємо список всіх існуючих файлів
-    initial_files = set()
-    for root, dirs, files in os.walk(directory_path):
-        for file in files:
-            file_path = os.path.join(root, file)
-            initial_files.add(file_path)
+    # Вікна, що дивляться в ту саму папку (або в її підпапки), використовують один сканер;
+    # список існуючих файлів береться з його кешу
+    subscription = await subscribe_scanner(engine, window_name, directory_path)
+    shared = subscription.shared
+    metrics = get_window_metrics(window_name)
+    outbox = get_outbox(window_name)
+    settle = get_settle_queue(window_name)
+
+    try:
+        try:
+            await engine.restore(window_name, directory_path, subscription)
+        except Exception as e:
+            get_window_metrics(window_name).error("restore")
+            log_message(window_name, f"Помилка відновлення збереженого стану: {e}", error=True)
+        initial_files = subscription.initial_files
+
+        log_message(window_name, f"Початок моніторингу папки: {directory_path}")
+        log_message(window_name, f"Ігнорується {len(initial_files)} існуючих файлів")
+        log_message(window_name, f"Поточний інтервал оновлення: {update_intervals.get(window_name, 5)} сек")
+        log_message(window_name, f"Спосіб відстеження змін: {shared.watcher.name} (сканер {shared.root}, вікон: {len(shared.subscriptions)})")
+        metrics.set_gauge("tracked_files", len(tracked_files[window_name]))
+
+        while not stop_monitoring_flags.get(window_name, False):
+            try:
+                interval = update_intervals.get(window_name, 5)
+                events = await subscription.get_events(min(outbox.wait_timeout(interval), settle.wait_timeout(interval)))
+                if not events and not settle.due():
+                    if outbox.due():
+                        await outbox.drain(engine, metrics)
+                    continue
+                started = time.perf_counter()
+                batch = FirebaseBatch()
+                await engine.run_in_scan(apply_file_events, window_name, batch, subscription, events, initial_files)
+                metrics.observe("diff_duration_seconds", time.perf_counter() - started)
+                await engine.commit(window_name, batch)
+
+                elapsed = time.perf_counter() - started
+                metrics.observe("cycle_duration_seconds", elapsed)
+                metrics.increment("cycles_total")
+                if elapsed > update_intervals.get(window_name, 5):
+                    metrics.increment("cycle_overruns_total")
+                metrics.set_gauge("tracked_files", len(tracked_files[window_name]))
+                metrics.set_gauge("last_cycle_timestamp_seconds", time.time())
+
+            except Exception as e:
+                metrics.error("sync")
+                log_message(window_name, f"Помилка синхронізації: {e}", error=True)
+                await asyncio.sleep(update_intervals.get(window_name, 5))
+    finally:
+        await unsubscribe_scanner(engine, window_name)
+
+def report_window_exit(window_name, future):
+    # Виняток, що вийшов за межі циклу вікна, інакше зник би разом із задачею
+    if future.cancelled() or future.exception() is None:
+        return
+    error = future.exception()
+    get_window_metrics(window_name).error("sync")
+    log_message(window_name, "Моніторинг зупинено через помилку:\n" +
+                "".join(traceback.format_exception(type(error), error, error.__traceback__)).rstrip(), error=True)
+
+class WindowHandle:
+    # Замінює потік вікна: ті самі is_alive()/join() для monitoring_threads, але над задачею asyncio
+    def __init__(self, future):
+        self.future = future
+
+    def is_alive(self):
+        return not self.future.done()
+
+    def join(self, timeout=None):
+        wait_futures([self.future], timeout)
+
+class MonitorEngine:
+    def __init__(self, scan_workers=4, io_workers=8):
+        # Обхід папок і запити до Firebase блокуючі, тож кожен тип роботи має власний обмежений пул
+        self.scan_executor = ThreadPoolExecutor(max_workers=scan_workers, thread_name_prefix="scan")
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="firebase")
+        self.loop = None
+        self.registry_lock = None
+        self.ready = threading.Event()
+
+    def bind_loop(self):
+        self.loop = asyncio.get_running_loop()
+        self.registry_lock = asyncio.Lock()
+        self.ready.set()
+
+    async def run_in_scan(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.scan_executor, func, *args)
+
+    async def run_in_io(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.io_executor, func, *args)
+
+    async def restore(self, window_name, directory_path, subscription):
+        await restore_outbox(self, window_name)
+        await prepare_record_schema(self, window_name, directory_path)
+        await restore_window_state(self, window_name, directory_path, subscription)
+
+    async def fetch_remote(self, window_name, local_keys):
+        return await fetch_remote_records(self, window_name, local_keys)
+
+    async def commit(self, window_name, batch):
+        await commit_batch(self, window_name, batch)
+
+    async def save_state(self, window_name, directory_path, subscription):
+        store = get_state_store()
+        if store:
+            await self.run_in_io(store.save_window, window_name, directory_path,
+                                 tracked_files[window_name], subscription.initial_files)
+
+    def start_in_thread(self):
+        # Для графічного інтерфейсу: цикл подій живе в окремому потоці, Tk - у головному
+        threading.Thread(target=asyncio.run, args=(self._serve_forever(),), daemon=True).start()
+        self.ready.wait()
+
+    async def _serve_forever(self):
+        self.bind_loop()
+        await asyncio.Event().wait()
+
+    def start_window(self, window_name, directory_path):
+        stop_monitoring_flags[window_name] = False
+        # process_mode: обхід, розбір імен і різниця вікна йдуть в окремому процесі, а не в потоках цього
+        in_process = window_configs.get(window_name, {}).get("process_mode", process_mode)
+        sync = sync_in_process if in_process else sync_with_firebase
+        future = asyncio.run_coroutine_threadsafe(sync(self, window_name, directory_path), self.loop)
+        future.add_done_callback(functools.partial(report_window_exit, window_name))
+        monitoring_threads[window_name] = WindowHandle(future)
+        return monitoring_threads[window_name]
 
-    log_message(window_name, f"Початок моніторингу папки: {directory_path}")
-    log_message(window_name, f"Ігнорується {len(initial_files)} існуючих файлів")
-    log_message(window_name, f"Поточний інтервал оновлення: {update_intervals.get(window_name, 5)} сек")
+    def wake_window(self, window_name):
+        # Пусте повідомлення в черзі вікна, щоб воно одразу перевірило прапорець зупинки
+        def wake():
+            process = window_processes.get(window_name)
+            if process is not None:
+                process.wake()
+                return
+            shared = window_scanners.get(window_name)
+            subscription = shared.subscriptions.get(window_name) if shared else None
+            if subscription is not None:
+                subscription.events.put_nowait([])
+        self.loop.call_soon_threadsafe(wake)
+
+    def stop_all(self):
+        for window_name in list(monitoring_threads):
+            stop_monitoring_flags[window_name] = True
+            self.wake_window(window_name)
+
+    async def serve(self, windows):
+        # Режим без інтерфейсу: усі вікна з config.json в одному циклі подій
+        self.bind_loop()
+        for window_name, data in windows.items():
+            directory_path = data.get("directory_path", "")
+            if not directory_path or not os.path.isdir(directory_path):
+                log_message(window_name, f"Пропущено вікно: некоректний шлях до папки '{directory_path}'", error=True)
+                continue
+            try:
+                update_intervals[window_name] = max(1, int(data.get("update_interval", 5)))
+            except ValueError:
+                update_intervals[window_name] = 5
+            configure_window(window_name, data)
+            self.start_window(window_name, directory_path)
+            log_message(window_name, "Моніторинг запущено")
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, self.stop_all)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        window_names = list(monitoring_threads)
+        futures = [asyncio.wrap_future(monitoring_threads[window_name].future) for window_name in window_names]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        # Подробиці кожної помилки вже в журналі вікна (report_window_exit)
+        failed = [name for name, result in zip(window_names, results) if isinstance(result, BaseException)]
+        if failed:
+            log_message("Global", f"Вікна, зупинені через помилку: {', '.join(failed)}", error=True)
+        log_message("Global", "Моніторинг усіх вікон зупинено")
+
+class WindowProcess:
+    # Процес вікна в режимі process_mode: туди - команда зупинки, назад - пакети змін, журнал і метрики
+    def __init__(self, engine, window_name, directory_path, remote):
+        import multiprocessing
+        context = multiprocessing.get_context("spawn")
+        self.loop = engine.loop
+        self.inbox = asyncio.Queue()
+        self.commands = context.Queue()
+        self.results = context.Queue()
+        settings = {
+            "config": runtime_config,
+            "window_config": window_configs.get(window_name, {}),
+            "update_interval": update_intervals.get(window_name, 5),
+            "schema_version": get_record_schema(window_name).version,
+            "state_file": STATE_FILE,
+        }
+        self.process = context.Process(
+            target=window_process_main, name=f"folderMonitor-{window_name}", daemon=True,
+            args=(window_name, directory_path, settings, remote, self.commands, self.results))
+
+    def start(self):
+        self.process.start()
+        threading.Thread(target=self.read_results, daemon=True).start()
+
+    def read_results(self):
+        # Черга процесу читається блокуюче в окремому потоці й перекладається в чергу циклу подій;
+        # після завершення процесу дочитується те, що він встиг записати
+        import queue
+        alive = True
+        while True:
+            try:
+                message = self.results.get(timeout=1 if alive else 0.1)
+            except queue.Empty:
+                if alive:
+                    alive = self.process.is_alive()
+                    continue
+                message = ("exit", self.process.exitcode)
+            self.loop.call_soon_threadsafe(self.inbox.put_nowait, message)
+            if message[0] == "exit":
+                return
 
-    while not stop_monitoring_flags.get(window_name, False):
+    def wake(self):
+        self.inbox.put_nowait(("wake",))
+
+    def stop(self):
+        self.commands.put("stop")
+
+    async def next_message(self, timeout):
         try:
-            # Скануємо тільки нові файли (не існуючі на момент запуску)
-            current_files = scan_directory_recursive(directory_path, initial_files)
-            log_message(window_name, f"Знайдено {len(current_files)} нових файлів з частотами у директорії")
-
-            # Видалені файли
-            deleted_files = set(tracked_files[window_name].keys()) - set(current_files.keys())
-            for file_path in deleted_files:
-                if file_path in tracked_files[window_name]:
-                    db.reference(f"/frequency/{window_name}/{tracked_files[window_name][file_path]['firebase_key']}").delete()
-                    log_message(window_name, f"Видалено частоту: {tracked_files[window_name][file_path]['frequency']} (файл: {file_path})")
-                    del tracked_files[window_name][file_path]
-
-            # Нові або змінені файли
-            for file_path, file_data in current_files.items():
-                if 'frequency' not in file_data:
-                    log_message(window_name, f"Пропущено файл без частоти: {file_path}", error=True)
+            return await asyncio.wait_for(self.inbox.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+async def sync_in_process(engine, window_name, directory_path):
+    # Тут лишаються черга відправки, локальний індекс і запити до Firebase для всіх вікон,
+    # а обхід папки, розбір імен і різниця виконуються в процесі вікна
+    metrics = get_window_metrics(window_name)
+    outbox = get_outbox(window_name)
+    store = get_state_store()
+    remote = None
+    try:
+        await restore_outbox(engine, window_name)
+        await prepare_record_schema(engine, window_name, directory_path)
+        local_keys = await engine.run_in_io(store.load_keys, window_name, directory_path) if store else set()
+        remote = await fetch_remote_records(engine, window_name, local_keys)
+    except Exception as e:
+        metrics.error("restore")
+        log_message(window_name, f"Помилка відновлення збереженого стану: {e}", error=True)
+
+    try:
+        process = WindowProcess(engine, window_name, directory_path, remote)
+        await engine.run_in_io(process.start)
+    except Exception as e:
+        metrics.error("sync")
+        log_message(window_name, f"Не вдалося запустити процес вікна: {e}", error=True)
+        return
+    window_processes[window_name] = process
+    log_message(window_name, f"Обхід і різниця вікна виконуються в окремому процесі (pid {process.process.pid})")
+    stop_deadline = None
+    try:
+        while True:
+            if stop_deadline is None and stop_monitoring_flags.get(window_name, False):
+                process.stop()
+                stop_deadline = time.monotonic() + 10
+            if stop_deadline is not None and time.monotonic() > stop_deadline:
+                log_message(window_name, "Процес вікна не зупинився вчасно і буде завершений примусово", error=True)
+                break
+            timeout = 1 if stop_deadline else outbox.wait_timeout(update_intervals.get(window_name, 5))
+            message = await process.next_message(timeout)
+            try:
+                if message is None:
+                    if outbox.due():
+                        await outbox.drain(engine, metrics)
+                elif message[0] == "exit":
+                    if message[1]:
+                        log_message(window_name, f"Процес вікна завершився з кодом {message[1]}", error=True)
+                    break
+                elif message[0] == "batch":
+                    batch = FirebaseBatch()
+                    batch.updates, batch.tracked_changes = await engine.run_in_io(pickle.loads, message[1])
+                    await commit_batch(engine, window_name, batch)
+                elif message[0] == "state" and store:
+                    tracked, initial_files = await engine.run_in_io(pickle.loads, message[1])
+                    await engine.run_in_io(store.save_window, window_name, directory_path, tracked, initial_files)
+                elif message[0] == "messages":
+                    for kind, *args in message[1]:
+                        if kind == "log":
+                            log_message(*args)
+                        else:
+                            getattr(metrics, args[0])(*args[1])
+            except Exception as e:
+                metrics.error("sync")
+                log_message(window_name, f"Помилка синхронізації: {e}", error=True)
+    finally:
+        window_processes.pop(window_name, None)
+        await engine.run_in_io(process.close)
+
+class WindowProcessEngine(MonitorEngine):
+    # Рушій усередині процесу вікна: читає папку й локальний індекс, а все, що пишеться
+    # у Firebase чи індекс, передає головному процесу
+    def __init__(self, results, outgoing, remote, schema_version):
+        super().__init__(scan_workers, 1)
+        self.results = results
+        # Журнал і метрики накопичуються й відправляються одним повідомленням, а не по рядку
+        self.outgoing = outgoing
+        self.send_lock = threading.Lock()
+        self.remote = remote
+        self.schema_version = schema_version
+
+    def send(self, *message):
+        with self.send_lock:
+            pending = []
+            while self.outgoing:
+                pending.append(self.outgoing.popleft())
+            if pending:
+                self.results.put(("messages", pending))
+            if message:
+                self.results.put(message)
+
+    async def serve_window(self, window_name, directory_path, commands):
+        self.bind_loop()
+        stop_monitoring_flags[window_name] = False
+        threading.Thread(target=self.read_commands, args=(window_name, commands), daemon=True).start()
+        await sync_with_firebase(self, window_name, directory_path)
+
+    def read_commands(self, window_name, commands):
+        # Процес зупиняється за командою або коли головний процес зник
+        import multiprocessing
+        import queue
+        parent = multiprocessing.parent_process()
+        while True:
+            try:
+                command = commands.get(timeout=0.2)
+            except queue.Empty:
+                self.send()
+                if parent is None or parent.is_alive():
                     continue
+                command = "stop"
+            if command == "stop":
+                stop_monitoring_flags[window_name] = True
+                self.wake_window(window_name)
+                return
 
-                if (file_path not in tracked_files[window_name] or
-                    file_data['last_modified'] > tracked_files[window_name][file_path]['last_modified']):
-
-                    if file_path not in tracked_files[window_name]:
-                        new_ref = db.reference(f"/frequency/{window_name}").push()
-                        tracked_files[window_name][file_path] = {
-                            'firebase_key': new_ref.key,
-                            'last_modified': file_data['last_modified'],
-                            'frequency': file_data['frequency']
-                        }
-                    else:
-                        new_ref = db.reference(f"/frequency/{window_name}/{tracked_files[window_name][file_path]['firebase_key']}")
-                        tracked_files[window_name][file_path]['last_modified'] = file_data['last_modified']
-                        tracked_files[window_name][file_path]['frequency'] = file_data['frequency']
-
-                    data = {
-                        'name': file_data['frequency'],
-                        'file_path': file_path,
-                        'timestamp': time.time(),
-                        'status': 'active',
-                        'last_modified': file_data['last_modified'],
-                        'window_name': window_name
-                    }
-                    new_ref.set(data)
-
-                    log_message(window_name, f"Оновлено частоту: {file_data['frequency']} (файл: {file_path})")
-
-            time.sleep(update_intervals.get(window_name, 5))
+    async def restore(self, window_name, directory_path, subscription):
+        window_schemas[window_name] = RecordSchema.from_version(self.schema_version, window_name, directory_path)
+        await restore_window_state(self, window_name, directory_path, subscription)
 
-        except Exception as e:
-            log_message(window_name, f"Помилка синхронізації: {e}", error=True)
-            time.sleep(update_intervals.get(window_name, 5))
+    async def fetch_remote(self, window_name, local_keys):
+        # Прочитано головним процесом перед запуском
+        return self.remote
+
+    # Черга multiprocessing серіалізує повідомлення у фоновому потоці, а записи tracked_files
+    # змінюються й далі, тож знімок пакета робиться тут же
+    async def commit(self, window_name, batch):
+        if batch.updates or batch.tracked_changes:
+            self.send("batch", pickle.dumps((batch.updates, batch.tracked_changes), pickle.HIGHEST_PROTOCOL))
+
+    async def save_state(self, window_name, directory_path, subscription):
+        self.send("state", pickle.dumps((tracked_files[window_name], subscription.initial_files), pickle.HIGHEST_PROTOCOL))
+
+def window_process_main(window_name, directory_path, settings, remote, commands, results):
+    global log_forward, STATE_FILE
+    # Зупинку по Ctrl+C обробляє головний процес
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    outgoing = deque()
+    log_forward = lambda name, message, error: outgoing.append(("log", name, message, error))
+    engine = None
+    try:
+        STATE_FILE = settings["state_file"]
+        apply_runtime_config(dict(settings["config"], log_file=None))
+        configure_window(window_name, settings["window_config"])
+        update_intervals[window_name] = settings["update_interval"]
+        window_metrics[window_name] = ForwardedMetrics(outgoing)
+        engine = WindowProcessEngine(results, outgoing, remote, settings["schema_version"])
+        asyncio.run(engine.serve_window(window_name, directory_path, commands))
+    except Exception as e:
+        log_message(window_name, f"Помилка процесу вікна: {e}", error=True)
+    finally:
+        if engine is None:
+            results.put(("messages", list(outgoing)))
+            results.put(("exit", None))
+        else:
+            engine.send("exit", None)
+
+def get_engine():
+    global monitor_engine
+    with monitor_engine_lock:
+        if monitor_engine is None:
+            monitor_engine = MonitorEngine(scan_workers, firebase_workers)
+            monitor_engine.start_in_thread()
+        return monitor_engine
+
+def run_headless():
+    global monitor_engine
+    config = load_config()
+    apply_runtime_config(config)
+    if not config.get("firebase_url") or not config.get("firebase_key_path"):
+        log_message("Global", f"У {CONFIG_FILE} не вказано firebase_url або firebase_key_path", error=True)
+        return 1
+    if not initialize_firebase(config["firebase_url"], config["firebase_key_path"]):
+        return 1
+
+    start_metrics_server(config)
+    monitor_engine = MonitorEngine(scan_workers, firebase_workers)
+    try:
+        asyncio.run(monitor_engine.serve(config.get("windows", {})))
+    except KeyboardInterrupt:
+        pass
+    return 0
 
 def start_monitoring_window(window_name, directory_path):
     global monitoring_threads, stop_monitoring_flags
@@ -206,13 +2598,7 @@ def start_monitoring_window(window_name, directory_path):
         messagebox.showerror("Помилка", f"Моніторинг для вікна {window_name} вже запущений!")
         return False
 
-    stop_monitoring_flags[window_name] = False
-    monitoring_threads[window_name] = threading.Thread(
-        target=sync_with_firebase,
-        args=(window_name, directory_path),
-        daemon=True
-    )
-    monitoring_threads[window_name].start()
+    get_engine().start_window(window_name, directory_path)
     log_message(window_name, "Моніторинг запущено")
     return True
 
@@ -220,6 +2606,7 @@ def stop_monitoring_window(window_name):
     global stop_monitoring_flags
     stop_monitoring_flags[window_name] = True
     if window_name in monitoring_threads and monitoring_threads[window_name].is_alive():
+        get_engine().wake_window(window_name)
         monitoring_threads[window_name].join(timeout=2)
     log_message(window_name, "Моніторинг зупинено")
     messagebox.showinfo("Інформація", f"Моніторинг для вікна {window_name} зупинено")
@@ -243,6 +2630,7 @@ class MonitoringWindow:
         self.directory_path = StringVar()
         self.update_interval = StringVar(value="5")
         self.monitoring_status = StringVar(value="Моніторинг вимкнено")
+        self.metrics_summary = StringVar(value=format_metrics_summary(window_name))
         self.status_color = "red"
         
         Label(self.window, text="Назва вікна:").grid(row=0, column=0, sticky="w", padx=10, pady=5)
@@ -255,12 +2643,15 @@ class MonitoringWindow:
         Entry(self.window, textvariable=self.directory_path, width=50).grid(row=1, column=1, padx=5, pady=5)
         Button(self.window, text="Огляд...", command=self.browse_directory).grid(row=1, column=2, padx=5, pady=5)
         
-        Label(self.window, text="Інтервал оновлення (сек):").grid(row=2, column=0, sticky="w", padx=10, pady=5)
+        Label(self.window, text="Базовий інтервал оновлення (сек):").grid(row=2, column=0, sticky="w", padx=10, pady=5)
         Entry(self.window, textvariable=self.update_interval, width=10).grid(row=2, column=1, sticky="w", padx=5, pady=5)
         
         Button(self.window, text="Почати моніторинг", command=self.start_monitoring).grid(row=3, column=1, pady=10)
         Button(self.window, text="Зупинити моніторинг", command=self.stop_monitoring).grid(row=4, column=1, pady=5)
         Button(self.window, text="Показати/сховати лог", command=self.toggle_log).grid(row=5, column=1, pady=5)
+
+        Label(self.window, textvariable=self.metrics_summary, fg="gray").grid(row=6, column=0, columnspan=3, sticky="w", padx=10, pady=5)
+        self.refresh_metrics()
         
         if window_name in self.main_app.windows_data:
             data = self.main_app.windows_data[window_name]
@@ -282,6 +2673,12 @@ class MonitoringWindow:
             self.status_color = "red"
         self.status_label.config(fg=self.status_color)
     
+    def refresh_metrics(self):
+        if not self.window.winfo_exists():
+            return
+        self.metrics_summary.set(format_metrics_summary(self.window_name))
+        self.window.after(1000, self.refresh_metrics)
+
     def start_monitoring(self):
         try:
             interval = int(self.update_interval.get())
@@ -293,11 +2690,14 @@ class MonitoringWindow:
             messagebox.showerror("Помилка", "Введіть коректне число для інтервалу оновлення")
             return False
 
-        self.main_app.windows_data[self.window_name] = {
+        # Оновлюємо лише поля форми, щоб не загубити додаткові налаштування вікна з config.json
+        window_config = self.main_app.windows_data.setdefault(self.window_name, {})
+        window_config.update({
             "directory_path": self.directory_path.get(),
             "update_interval": self.update_interval.get()
-        }
+        })
         self.main_app.save_windows_data()
+        configure_window(self.window_name, window_config)
 
         if start_monitoring_window(
             self.window_name,
@@ -321,6 +2721,8 @@ class MainApp:
         self.root.title("Folder-Firebase Sync Manager")
 
         self.config = load_config()
+        apply_runtime_config(self.config)
+        start_metrics_server(self.config)
         self.windows_data = self.config.get("windows", {})
         
         self.firebase_url = StringVar(value=self.config.get("firebase_url", ""))
@@ -348,7 +2750,10 @@ class MainApp:
         root.grid_rowconfigure(4, weight=1)
         root.grid_columnconfigure(1, weight=1)
         
+        start_log_pump(root)
         create_log_window("Global")
+        # Вікно вже намальоване; SDK підвантажується після першого циклу подій Tk
+        root.after(100, lambda: threading.Thread(target=preload_firebase, daemon=True).start())
     
     def browse_key_file(self):
         from tkinter import filedialog
@@ -457,9 +2862,25 @@ class MainApp:
             
             if window_name in tracked_files:
                 del tracked_files[window_name]
+
+            store = get_state_store()
+            if store:
+                store.delete_window(window_name)
             
             if window_name in update_intervals:
                 del update_intervals[window_name]
+
+            frequency_parsers.pop(window_name, None)
+            outboxes.pop(window_name, None)
+            settle_queues.pop(window_name, None)
+            window_walk_workers.pop(window_name, None)
+            min_intervals.pop(window_name, None)
+            max_intervals.pop(window_name, None)
+            window_schema_names.pop(window_name, None)
+            window_schemas.pop(window_name, None)
+            window_configs.pop(window_name, None)
+            with window_metrics_lock:
+                window_metrics.pop(window_name, None)
             
             if window_name in monitoring_threads:
                 del monitoring_threads[window_name]
@@ -478,6 +2899,21 @@ class MainApp:
             log_message("Global", f"Вікно {window_name} повністю видалено")
 
 if __name__ == "__main__":
+    if getattr(sys, "frozen", False):
+        # Процеси вікон (process_mode) у збірці PyInstaller запускаються через той самий exe
+        import multiprocessing
+        multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="Folder-Firebase Sync Manager")
+    parser.add_argument("--headless", action="store_true",
+                        help="запустити всі вікна з config.json без графічного інтерфейсу")
+    parser.add_argument("--config", default=CONFIG_FILE, help="шлях до config.json")
+    args = parser.parse_args()
+    CONFIG_FILE = args.config
+    STATE_FILE = os.path.join(os.path.dirname(CONFIG_FILE), "monitor_state.db")
+
+    if args.headless:
+        sys.exit(run_headless())
+
     root = Tk()
     app = MainApp(root)
     root.mainloop()
\ No newline at end of file
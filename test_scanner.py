@@ -0,0 +1,196 @@
+# Перевірка сканера папок і бекендів спостереження без Firebase:
+#
+#     python -m pytest -q test_scanner.py
+import asyncio
+import errno
+import os
+import shutil
+import sys
+import time
+
+import pytest
+
+import startMonitor
+
+def create(*paths):
+    for path in paths:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w"):
+            pass
+
+def age(*paths, seconds=1000):
+    # Старий mtime каталогу - сканер довіряє кешу, а не перечитує щойно змінений каталог
+    for path in paths:
+        stamp = time.time() - seconds
+        os.utime(path, (stamp, stamp))
+
+def run_on_engine(coroutine):
+    engine = startMonitor.get_engine()
+    return asyncio.run_coroutine_threadsafe(coroutine, engine.loop).result(10)
+
+def read_events(watcher):
+    async def read():
+        engine = startMonitor.MonitorEngine(1, 1)
+        return await watcher.read_events(engine, 1, asyncio.Event())
+    return asyncio.run(read())
+
+inotify = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify є лише в Linux")
+
+@pytest.fixture
+def watcher(tmp_path):
+    scanner = startMonitor.IncrementalScanner(str(tmp_path))
+    watcher = startMonitor.InotifyWatcher(scanner)
+    scanner.scan()
+    yield watcher
+    watcher.close()
+    scanner.close()
+
+@inotify
+def test_inotify_watch_limit_keeps_events_and_requests_rescan(watcher, tmp_path, monkeypatch):
+    add_watch = watcher._add_watch
+    def limited(path):
+        if path != str(tmp_path):
+            raise OSError(errno.ENOSPC, "inotify watch limit reached")
+        return add_watch(path)
+    monkeypatch.setattr(watcher, "_add_watch", limited)
+    create(str(tmp_path / "new" / "b_146000.wav"), str(tmp_path / "a_145000.wav"))
+
+    events = watcher.read_pending()
+    assert startMonitor.FileEvent("created", str(tmp_path / "a_145000.wav")) in events
+    assert startMonitor.FileEvent("rescan", str(tmp_path)) in events
+
+@inotify
+def test_inotify_new_directory_reports_existing_files(watcher, tmp_path):
+    create(str(tmp_path / "new" / "deep" / "b_146000.wav"))
+    events = watcher.read_pending()
+    assert startMonitor.FileEvent("created", str(tmp_path / "new" / "deep" / "b_146000.wav")) in events
+    create(str(tmp_path / "new" / "deep" / "c_147000.wav"))
+    assert startMonitor.FileEvent("created", str(tmp_path / "new" / "deep" / "c_147000.wav")) in watcher.read_pending()
+
+@inotify
+def test_inotify_safety_rescan_finds_missed_files(watcher, tmp_path, monkeypatch):
+    monkeypatch.setattr(startMonitor, "full_rescan_seconds", 0.1)
+    create(str(tmp_path / "a_145000.wav"))
+    # Подію "втрачено": черга ядра прочитана, але не розібрана
+    watcher._read_raw()
+    watcher._last_full -= 1
+
+    events = read_events(watcher)
+    assert [(event.kind, event.path) for event in events] == [("created", str(tmp_path / "a_145000.wav"))]
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_incremental_scan_reports_added_changed_removed(tmp_path, workers):
+    root = str(tmp_path)
+    x, y = os.path.join(root, "a", "x_145000.wav"), os.path.join(root, "b", "sub", "y_146000.wav")
+    create(x, y)
+    age(os.path.dirname(x), os.path.dirname(y), os.path.join(root, "b"), root)
+    scanner = startMonitor.IncrementalScanner(root, workers)
+    try:
+        diff = scanner.scan()
+        assert diff.added == {x: os.path.getmtime(x), y: os.path.getmtime(y)}
+        assert not diff.changed and not diff.removed
+
+        assert scanner.scan() == ({}, {}, [])
+        assert scanner.dirs_listed == 0
+
+        z = os.path.join(root, "a", "z_147000.wav")
+        create(z)
+        os.remove(y)
+        age(os.path.dirname(x), os.path.dirname(y), seconds=500)
+        diff = scanner.scan()
+        assert diff.added == {z: os.path.getmtime(z)}
+        assert diff.removed == [y]
+
+        # Зміна вмісту файлу не змінює mtime каталогу - її бачить лише повний прохід
+        age(x, seconds=10)
+        assert scanner.scan() == ({}, {}, [])
+        assert scanner.scan(full=True).changed == {x: os.path.getmtime(x)}
+
+        shutil.rmtree(os.path.join(root, "a"))
+        diff = scanner.scan()
+        assert sorted(diff.removed) == sorted([x, z])
+        assert scanner.iter_files(root) == []
+    finally:
+        scanner.close()
+
+def test_parent_scanner_absorbs_child_scanner(tmp_path, monkeypatch):
+    monkeypatch.setattr(startMonitor, "log_console", False)
+    engine = startMonitor.get_engine()
+    child_path, parent_path = str(tmp_path / "parent" / "child"), str(tmp_path / "parent")
+    create(os.path.join(child_path, "a_145000.wav"), os.path.join(parent_path, "b_146000.wav"))
+    child_window, parent_window = "absorb_child", "absorb_parent"
+    try:
+        child = run_on_engine(startMonitor.subscribe_scanner(engine, child_window, child_path))
+        child_scanner = child.shared
+        parent = run_on_engine(startMonitor.subscribe_scanner(engine, parent_window, parent_path))
+
+        # Одне дерево - один сканер; вікно вкладеної папки переходить на нього й звіряється повністю
+        assert parent.shared.key == os.path.normcase(os.path.realpath(parent_path))
+        assert [scanner.key for scanner in startMonitor.shared_scanners.values()
+                if scanner.covers(child.key)] == [parent.shared.key]
+        assert child.shared is parent.shared and child_scanner.stopped.is_set()
+        assert startMonitor.window_scanners[child_window] is parent.shared
+        assert child.events.get_nowait() == [startMonitor.FileEvent("rescan", child_path)]
+        assert set(child.snapshot()) == {os.path.join(child_path, "a_145000.wav")}
+        assert set(parent.snapshot()) == {os.path.join(child_path, "a_145000.wav"), os.path.join(parent_path, "b_146000.wav")}
+
+        # Нове вікно тієї ж папки підписується на наявний сканер
+        again = run_on_engine(startMonitor.subscribe_scanner(engine, "absorb_again", child_path))
+        assert again.shared is parent.shared
+        assert os.path.join(child_path, "a_145000.wav") in again.initial_files
+    finally:
+        for window_name in (child_window, parent_window, "absorb_again"):
+            run_on_engine(startMonitor.unsubscribe_scanner(engine, window_name))
+    assert parent.shared.stopped.is_set()
+
+def test_settle_queue_holds_files_until_quiet(tmp_path):
+    settle = startMonitor.SettleQueue("settle", 0.2)
+    growing, rewritten, removed = (str(tmp_path / name) for name in ("a_145000.wav", "b_146000.wav", "c_147000.wav"))
+    create(growing, rewritten, removed)
+    for path in (growing, rewritten, removed):
+        assert settle.hold(path, "145.000", os.path.getmtime(path))
+    assert not settle.due() and settle.collect() == []
+
+    # Дозапис до кінця періоду тиші переносить публікацію
+    with open(growing, "a") as file:
+        file.write("data")
+    assert settle.hold(growing, "145.000", os.path.getmtime(growing))
+    os.remove(removed)
+    time.sleep(0.25)
+    with open(rewritten, "a") as file:
+        file.write("data")
+
+    assert settle.due()
+    ready = settle.collect()
+    assert [(path, frequency, last_modified, writes) for path, frequency, last_modified, _, writes in ready] == [
+        (growing, "145.000", os.path.getmtime(growing), 1)]
+    assert ready[0][3] >= 0.2
+    # Зміну під час очікування помічає повторний stat у collect
+    assert list(settle.pending) == [rewritten] and settle.pending[rewritten].writes == 1
+
+    time.sleep(0.25)
+    assert [item[0] for item in settle.collect()] == [rewritten]
+    assert not settle
+
+def test_settle_queue_passes_old_and_discarded_files(tmp_path):
+    settle = startMonitor.SettleQueue("settle", 0.2)
+    old, nested = str(tmp_path / "a_145000.wav"), str(tmp_path / "sub" / "b_146000.wav")
+    create(old, nested)
+    age(old)
+    assert not settle.hold(old, "145.000", os.path.getmtime(old))
+    assert settle.hold(nested, "146.000", os.path.getmtime(nested))
+    settle.discard(str(tmp_path / "sub"))
+    assert not settle
+
+    settle.quiet = 0
+    assert not settle.hold(nested, "146.000", os.path.getmtime(nested))
+
+def test_path_digest_set_drops_paths_in_one_pass():
+    paths = [f"/monitor/sub{i % 7}/f{i}_145000.wav" for i in range(1000)]
+    initial = startMonitor.PathDigestSet(paths)
+    initial.difference_update(paths[::2] + ["/monitor/missing.wav"])
+    assert len(initial) == 500
+    assert all(path not in initial for path in paths[::2])
+    assert all(path in initial for path in paths[1::2])
+    assert list(initial.digests) == sorted(initial.digests)
+    assert startMonitor.PathDigestSet.from_bytes(initial.to_bytes()).digests == initial.digests
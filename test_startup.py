@@ -0,0 +1,11 @@
+# Запуск startMonitor не має тягнути Firebase SDK і HTTP-модулі (вони вантажаться при першому підключенні):
+#
+#     python -m pytest -q test_startup.py
+import benchmark
+
+def test_startup_does_not_import_lazy_modules():
+    imported = {name for name, _, _, _ in benchmark.import_times("import startMonitor")}
+    assert "startMonitor" in imported
+    eager = sorted(name for name in imported for lazy in benchmark.LAZY_MODULES
+                   if name == lazy or name.startswith(lazy + "."))
+    assert eager == []
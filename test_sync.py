@@ -0,0 +1,215 @@
+# Перевірка кількості запитів до Firebase на локальній заміні бази (fake_firebase):
+#
+#     python -m pytest -q test_sync.py
+import asyncio
+import os
+import time
+
+import pytest
+
+import fake_firebase
+import startMonitor
+
+class Window:
+    def __init__(self, name, directory_path):
+        self.name = name
+        self.directory_path = directory_path
+        self.logs = []
+        self.handle = None
+
+    def start(self):
+        self.handle = startMonitor.get_engine().start_window(self.name, self.directory_path)
+        wait_until(lambda: self.logged("Початок моніторингу папки"))
+
+    def stop(self):
+        if self.handle is not None and self.handle.is_alive():
+            startMonitor.stop_monitoring_flags[self.name] = True
+            startMonitor.get_engine().wake_window(self.name)
+            self.handle.join(5)
+            assert not self.handle.is_alive()
+
+    def restart(self):
+        # Новий запуск програми: у пам'яті нічого, стан лише в локальному індексі й на сервері
+        self.stop()
+        for registry in (startMonitor.tracked_files, startMonitor.outboxes, startMonitor.window_schemas):
+            registry.pop(self.name, None)
+        self.logs.clear()
+        self.start()
+
+    def logged(self, text):
+        return any(text in message for message in self.logs)
+
+    def create(self, *names):
+        for name in names:
+            with open(os.path.join(self.directory_path, name), "w"):
+                pass
+
+    def records(self):
+        return (database().root.get("frequency") or {}).get(self.name) or {}
+
+    def record(self, name, frequency, key=None):
+        file_path = os.path.join(self.directory_path, name)
+        mtime = os.path.getmtime(file_path) if os.path.exists(file_path) else 0.0
+        record = startMonitor.RecordSchema("full", self.name).record(file_path, frequency, mtime)
+        key = key or database().next_push_key()
+        database().root.setdefault("frequency", {}).setdefault(self.name, {})[key] = record
+        return key
+
+def database():
+    return startMonitor.db
+
+def wait_until(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            pytest.fail("умова не виконалась за відведений час")
+        time.sleep(0.05)
+
+def run_on_engine(coroutine):
+    engine = startMonitor.get_engine()
+    return asyncio.run_coroutine_threadsafe(coroutine, engine.loop).result(10)
+
+@pytest.fixture
+def window(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(startMonitor, "db", fake_firebase.FakeDatabase())
+    monkeypatch.setattr(startMonitor, "database_ref", True)
+    monkeypatch.setattr(startMonitor, "STATE_FILE", str(tmp_path / "state.db"))
+    monkeypatch.setattr(startMonitor, "state_store", None)
+    monkeypatch.setattr(startMonitor, "log_console", False)
+    monkeypatch.setattr(startMonitor, "outbox_retry_base", 0.1)
+    monkeypatch.setattr(startMonitor, "outbox_retry_max", 0.2)
+
+    directory_path = tmp_path / "files"
+    directory_path.mkdir()
+    window = Window(request.node.name, str(directory_path))
+    log_message = startMonitor.log_message
+    def capture(window_name, message, error=False):
+        if window_name == window.name:
+            window.logs.append(message)
+        log_message(window_name, message, error)
+    monkeypatch.setattr(startMonitor, "log_message", capture)
+
+    startMonitor.update_intervals[window.name] = 1
+    startMonitor.configure_window(window.name, {"settle_seconds": 0})
+    yield window
+    window.stop()
+    if startMonitor.state_store is not None:
+        startMonitor.state_store.connection.close()
+
+def test_cycle_sends_one_multi_path_update(window):
+    window.start()
+    database().reset_counters()
+    cycles = startMonitor.get_window_metrics(window.name).counters["cycles_total"]
+    window.create("a_145000.wav", "b_146000.wav", "c_147500.wav")
+    wait_until(lambda: len(window.records()) == 3)
+
+    cycles = startMonitor.get_window_metrics(window.name).counters["cycles_total"] - cycles
+    assert database().requests == [("update", f"/frequency/{window.name}")] * cycles
+    assert sorted(record["name"] for record in window.records().values()) == ["145.000", "146.000", "147.500"]
+
+def test_large_batch_is_split_into_chunks(window, monkeypatch):
+    monkeypatch.setattr(startMonitor, "firebase_batch_max_paths", 2)
+    window.start()
+    database().reset_counters()
+    schema = startMonitor.get_record_schema(window.name)
+    batch = startMonitor.FirebaseBatch()
+    for n in range(5):
+        batch.set(f"key{n}", schema.record(f"{window.directory_path}/f{n}_14{n}000.wav", f"14{n}.000", 0.0))
+    run_on_engine(startMonitor.commit_batch(startMonitor.get_engine(), window.name, batch))
+
+    assert database().requests == [("update", f"/frequency/{window.name}")] * 3
+    assert len(window.records()) == 5
+
+def test_offline_changes_drain_in_one_request(window):
+    window.start()
+    outbox = startMonitor.get_outbox(window.name)
+    database().offline = True
+    window.create("a_145000.wav", "b_146000.wav")
+    wait_until(lambda: len(outbox) == 2)
+    window.create("c_147000.wav")
+    os.remove(os.path.join(window.directory_path, "a_145000.wav"))
+    wait_until(lambda: len(outbox) == 3 and outbox.failures >= 2)
+
+    database().reset_counters()
+    database().offline = False
+    wait_until(lambda: not outbox)
+    assert database().requests == [("update", f"/frequency/{window.name}")]
+    assert sorted(record["name"] for record in window.records().values()) == ["146.000", "147.000"]
+
+def test_restart_costs_two_reads(window):
+    window.start()
+    window.create("a_145000.wav", "b_146000.wav")
+    wait_until(lambda: len(window.records()) == 2)
+
+    database().reset_counters()
+    window.restart()
+    assert database().requests == [
+        ("get", f"/frequency_meta/{window.name}/schema"),
+        ("get", f"/frequency/{window.name}"),
+    ]
+    assert {os.path.basename(path) for path in startMonitor.tracked_files[window.name]} == {"a_145000.wav", "b_146000.wav"}
+    assert window.logged("Відновлено стан з")
+
+def test_schema_migrates_to_compact_and_back(window):
+    window.start()
+    window.create("a_145000.wav", "b_146000.wav")
+    wait_until(lambda: len(window.records()) == 2)
+    keys = set(window.records())
+    meta = lambda: database().root["frequency_meta"][window.name]["schema"]
+    assert meta() == 1
+
+    startMonitor.configure_window(window.name, {"settle_seconds": 0, "firebase_schema": "compact"})
+    window.restart()
+    records = window.records()
+    assert set(records) == keys and meta() == 2
+    assert sorted((record["p"], record["f"]) for record in records.values()) == [
+        ("a_145000.wav", "145.000"), ("b_146000.wav", "146.000")]
+    assert all(set(record) == {"f", "p", "m", "t"} for record in records.values())
+
+    startMonitor.configure_window(window.name, {"settle_seconds": 0, "firebase_schema": "full"})
+    window.restart()
+    records = window.records()
+    assert set(records) == keys and meta() == 1
+    assert sorted((record["file_path"], record["name"], record["status"]) for record in records.values()) == [
+        (os.path.join(window.directory_path, "a_145000.wav"), "145.000", "active"),
+        (os.path.join(window.directory_path, "b_146000.wav"), "146.000", "active")]
+    assert window.logged("Записи мігровано з версії 2 на 1")
+
+def test_clear_removes_records_and_schema_version(window):
+    window.start()
+    window.create("a_145000.wav")
+    wait_until(lambda: len(window.records()) == 1)
+    window.stop()
+
+    database().reset_counters()
+    assert startMonitor.clear_firebase_data(window.name)
+    assert database().requests == [("update", "/")]
+    assert window.name not in database().root.get("frequency", {})
+    assert window.name not in database().root.get("frequency_meta", {})
+
+def test_reconcile_adopts_and_orphans_records(window):
+    window.create("a_145000.wav", "b_146000.wav")
+    adopted = window.record("a_145000.wav", "145.000")
+    orphan = window.record("gone_150000.wav", "150.000")
+    stale = window.record("a_145000.wav", "145.000")
+    # Видалення, що чекає в черзі з минулого запуску, не скасовується звіркою
+    pending = window.record("b_146000.wav", "146.000")
+    startMonitor.get_outbox(window.name).add({pending: None})
+
+    window.start()
+    wait_until(lambda: not startMonitor.get_outbox(window.name))
+    tracked = startMonitor.tracked_files[window.name]
+    assert {os.path.basename(path): entry.firebase_key for path, entry in tracked.items()} == {"a_145000.wav": adopted}
+    assert set(window.records()) == {adopted}
+    assert not {orphan, stale, pending} & set(window.records())
+
+def test_reconcile_reuploads_incomplete_records(window):
+    window.create("a_145000.wav")
+    key = window.record("a_145000.wav", "145.000")
+    del database().root["frequency"][window.name][key]["name"]
+
+    window.start()
+    wait_until(lambda: not startMonitor.get_outbox(window.name))
+    record = window.records()[key]
+    assert record["name"] == "145.000"
+    assert record["last_modified"] == os.path.getmtime(os.path.join(window.directory_path, "a_145000.wav"))